@@ -1,44 +1,262 @@
+import asyncio
+import functools
+import json
+import io
 import math
+import os
+import sys
 import time
 import sqlite3
+import click
 from flask import Flask, abort
-from flask import redirect, render_template, request, session, flash, make_response, g
+from flask import redirect, render_template, request, session, flash, send_file, g
+from flask import Response, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 import markupsafe
 import reviews_db
 import users_db
 import recipes_db
 import tags_db
+import search_db
 import config
+import db
+import counters_db
+import images
+import pagination
+import page_cache
+import metrics
+import async_db
+import migrations
+import index_advisor
+import validation
+import recipe_import
+import suggest_index
+import export
 
 app = Flask(__name__)
 app.secret_key = config.SECRET_KEY
 
 @app.before_request
 def before_request():
-    g.start_time = time.time()
+    g.start_time = time.perf_counter()
+    g.db_statements = 0
+    g.db_statement_time = 0
 
 @app.after_request
 def after_request(response):
-    duration = time.time() - g.start_time
-    print(f'{request.method} {request.path} completed in {duration:.5f}s')
+    duration = time.perf_counter() - g.start_time
+    endpoint = request.endpoint or 'unknown'
+    over_budget = g.db_statements > config.DB_STATEMENT_BUDGET
+    metrics.observe_request(endpoint, request.method, response.status_code, duration, g.db_statements, over_budget)
+    print(f'{request.method} {request.path} completed in {duration:.5f}s '
+          f'({g.db_statements} queries, {g.db_statement_time:.5f}s)')
+    if over_budget:
+        app.logger.warning('%s %s ran %d SQL statements (budget %d), possible N+1 queries',
+                           request.method, request.path, g.db_statements, config.DB_STATEMENT_BUDGET)
     return response
 
-@app.route('/')
-@app.route('/<int:page>')
-def index(page=1):
-    page_size = 10
-    recipe_count = recipes_db.get_recipe_count()
+app.teardown_appcontext(db.close_connection)
+
+@app.cli.command('init-db')
+def init_db():
+    if migrations.is_empty():
+        migrations.create_schema()
+    else:
+        db.apply_schema()
+    print('Database schema is up to date.')
+
+@app.cli.command('migrate')
+@click.option('--status', is_flag=True, help='Only show the schema version and pending migrations.')
+def migrate(status):
+    if status:
+        print(f'Schema version {migrations.get_version()}, latest {migrations.LATEST_VERSION}.')
+        for version, description, _ in migrations.get_pending():
+            print(f'Pending migration {version}: {description}')
+        return
+    migrations.migrate()
+
+@app.cli.command('index-advisor')
+def advise_indexes():
+    advice = index_advisor.advise(app)
+    print(f'Checked the query plans of {advice["statements"]} statements.')
+    for name, covered_by in advice['redundant']:
+        print(f'Redundant: {name} is covered by {covered_by}')
+    for name in advice['unused']:
+        print(f'Unused: {name} is not used by any of the statements')
+    for (table, columns), (reason, sql) in sorted(advice['missing'].items()):
+        print(f'Missing: CREATE INDEX ON {table}({", ".join(columns)}) -- {reason}')
+        print(f'    {" ".join(sql.split())[:200]}')
+    if not (advice['redundant'] or advice['unused'] or advice['missing']):
+        print('No suggestions.')
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(sorted(export.EXPORTS)))
+@click.option('--output', '-o', default='-', help='File to write, - for standard output.')
+@click.option('--gzip/--no-gzip', 'compress', default=None, help='Compress the output; the default is to compress .gz files.')
+def export_table_command(table, output, compress):
+    if compress is None:
+        compress = output.endswith('.gz')
+    if output == '-':
+        written = export.write(table, sys.stdout.buffer, compress)
+    else:
+        with open(output, 'wb') as f:
+            written = export.write(table, f, compress)
+    click.echo(f'Exported {table}: {written} bytes.', err=True)
+
+@app.cli.command('import-recipes')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'username', required=True, help='User who will own the recipes.')
+@click.option('--image-dir', type=click.Path(file_okay=False), help='Directory of image_path files; defaults to the file\'s directory.')
+@click.option('--batch-size', default=None, type=int, help='Input lines per transaction.')
+@click.option('--key', help='Name of the import for resuming; defaults to a hash of the file and user.')
+def import_recipes_command(path, username, image_dir, batch_size, key):
+    user = users_db.get_user(username)
+    if not user:
+        raise click.ClickException(f'No user named {username}.')
+    key = key or recipe_import.file_key(path, user['id'])
+    done = recipe_import.get_progress(key)
+    if done['finished']:
+        print(f'Already imported: {done["recipes"]} recipes from {done["lines"]} lines.')
+        return
+    if done['lines']:
+        print(f'Resuming after line {done["lines"]}.')
+
+    def report(progress):
+        rate = progress['recipes'] / progress['elapsed'] if progress['elapsed'] else 0
+        print(f'{progress["lines"]} lines: {progress["recipes"]} recipes, {progress["errors"]} rejected '
+              f'({rate:.0f} recipes/s)')
+    with open(path, encoding='utf-8') as f:
+        progress, rejected = recipe_import.import_lines(f, user['id'], key,
+                                                        image_dir or os.path.dirname(os.path.abspath(path)),
+                                                        batch_size, report)
+    for line_number, message in rejected:
+        print(f'Line {line_number}: {message}', file=sys.stderr)
+    print(f'Imported {progress["recipes"]} recipes, rejected {progress["errors"]} lines.')
+
+@app.cli.command('rebuild-recipe-stats')
+def rebuild_recipe_stats():
+    reviews_db.rebuild_recipe_stats()
+    print('Recipe rating statistics rebuilt.')
+
+@app.cli.command('build-search-index')
+def build_search_index():
+    recipes_db.build_search_index()
+    print(f'Search index rebuilt with tokenizer {config.SEARCH_TOKENIZER!r}.')
+
+@app.cli.command('check-counters')
+@click.option('--repair', is_flag=True, help='Overwrite wrong counters with the actual counts.')
+def check_counters(repair):
+    mismatches = counters_db.check_counters(repair)
+    for name, (stored, actual) in sorted(mismatches.items()):
+        print(f'{name}: stored {stored}, actual {actual}')
+    if not mismatches:
+        print('All counters are consistent.')
+    elif repair:
+        print(f'Repaired {len(mismatches)} counters.')
+
+@app.cli.command('slow-queries')
+@click.option('--top', default=10, help='Number of statements to show.')
+@click.option('--plans/--no-plans', default=True, help='Show the query plan of each statement.')
+def slow_queries(top, plans):
+    offenders = db.summarize_slow_queries(top)
+    if not offenders:
+        print(f'No slow queries in {config.DB_SLOW_QUERY_LOG}.')
+    for fingerprint, item in offenders:
+        print(f'{item["total"]:.3f}s total, {item["count"]} times, max {item["max"]:.3f}s [{fingerprint}]')
+        print(f'    {item["sql"] or "(statement text is in a rotated-out log file)"}')
+        for route in sorted(item['routes']):
+            print(f'    route: {route}')
+        if plans:
+            for detail in item['plan'] or []:
+                print(f'    plan: {detail}')
+
+@app.cli.command('migrate-images')
+def migrate_images():
+    migrated = recipes_db.migrate_images(progress=lambda migrated: print(f'Migrated {migrated} images'))
+    print(f'Moved {migrated} images to {config.IMAGE_DIR}.')
+
+@app.cli.command('generate-image-variants')
+def generate_image_variants():
+    if images.Image is None:
+        print('Pillow is not installed, cannot resize images.')
+        return
+    image_hashes = recipes_db.get_image_hashes()
+    futures = [images.generate_variants_in_background(image_hash) for image_hash in image_hashes]
+    failed = 0
+    for done, (image_hash, future) in enumerate(zip(image_hashes, futures), 1):
+        try:
+            future.result()
+        except Exception as error:  # an unreadable image must not stop the rest
+            failed += 1
+            print(f'Image {image_hash}: {error}', file=sys.stderr)
+        if done % 100 == 0 or done == len(futures):
+            print(f'Generated variants for {done - failed}/{len(futures)} images ({failed} failed)')
+
+def async_variant(async_view):
+    # With config.ASYNC_VIEWS the route runs its async twin, which awaits
+    # independent queries concurrently on the async_db thread pool. Flask
+    # needs the 'async' extra (asgiref) for that.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            if config.ASYNC_VIEWS:
+                return app.ensure_sync(async_view)(**kwargs)
+            return view(**kwargs)
+        return wrapper
+    return decorator
+
+def request_cursor():
+    # The (key, page) of a ?before= or ?after= link, or None.
+    return pagination.decode_cursor(request.args.get('after') or request.args.get('before'))
+
+def index_recipes(recipes, cursor, page, page_size):
+    # recipes is recipes_db or async_db.recipes: the same call returns the
+    # rows or a coroutine for them.
+    if cursor:
+        key, page = cursor
+        if 'before' in request.args:
+            return recipes.get_recipes_seek(page_size, before=key)
+        return recipes.get_recipes_seek(page_size, after=key)
+    return recipes.get_recipes(page, page_size)
+
+def render_index(page, cursor, recipe_count, recipes, page_size):
+    # The page is read alongside the count; a page past the end is only
+    # redirected away from.
     page_count = math.ceil(recipe_count / page_size)
     page_count = max(page_count, 1)
+    if cursor:
+        page = min(max(cursor[1], 1), page_count)
+        if 'before' in request.args and len(recipes) < page_size:
+            return redirect('/')
+        if 'before' not in request.args and not recipes:
+            return redirect(f'/{page_count}')
+    elif page > page_count:
+        return redirect(f'/{page_count}')
 
-    if page < 1:
+    prev_cursor, next_cursor = pagination.cursors(recipes, page, page_count, lambda r: (r['name'], r['id']))
+    return render_template('index.html.j2', page=page, page_count=page_count, recipes=recipes, prev_cursor=prev_cursor, next_cursor=next_cursor)
+
+async def index_async(page=1):
+    page_size = 10
+    cursor = request_cursor()
+    if not cursor and page < 1:
         return redirect('/1')
-    if page > page_count:
-        return redirect(f'/{page_count}')
+    recipe_count, recipes = await asyncio.gather(async_db.recipes.get_recipe_count(),
+                                                 index_recipes(async_db.recipes, cursor, page, page_size))
+    return render_index(page, cursor, recipe_count, recipes, page_size)
 
-    recipes = recipes_db.get_recipes(page, page_size)
-    return render_template('index.html.j2', page=page, page_count=page_count, recipes=recipes)
+@app.route('/')
+@app.route('/<int:page>')
+@page_cache.cached_page(lambda **kwargs: ['version:global'])
+@async_variant(index_async)
+def index(page=1):
+    page_size = 10
+    cursor = request_cursor()
+    if not cursor and page < 1:
+        return redirect('/1')
+    recipe_count = recipes_db.get_recipe_count()
+    recipes = index_recipes(recipes_db, cursor, page, page_size)
+    return render_index(page, cursor, recipe_count, recipes, page_size)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -116,104 +334,159 @@ def add_recipe():
         name = request.form['name']
         content = request.form['content']
         file = request.files.get('image')
-        tags = request.form['tags'].casefold().replace(',', ' ').split()
+        tags = validation.parse_tags(request.form['tags'])
         image = None
         image_type = None
-        error_found = False
+        errors = []
 
         if file:
-            if not allowed_image(file.filename):
-                flash('ERROR: Invalid image file type.')
-                file = None
-                error_found = True
-            else:
-                image = file.read()
-                image_type = file.filename.rsplit('.', 1)[1].lower()
-                max_size = config.MAX_IMAGE_SIZE / (1024 * 1024)
-                if len(image) > config.MAX_IMAGE_SIZE:
-                    flash(f'ERROR: Image file size exceeds the maximum limit of {max_size:.2f} MB.')
-                    file, image = None, None
-                    error_found = True
-        if not name:
-            flash('ERROR: Recipe name is required.')
-            error_found = True
-        if len(name) > 100:
-            flash('ERROR: Recipe name is too long (maximum 100 characters).')
-            name = name[:100]
-            error_found = True
-        if len(content) > 5000:
-            flash('ERROR: Recipe content is too long (maximum 5000 characters).')
-            content = content[:5000]
-            error_found = True
-        if error_found:
+            image, image_type, image_errors = read_image(file)
+            errors += image_errors
+        errors += validation.recipe_errors(name, content)
+        for error in errors:
+            flash('ERROR: ' + error)
+        name = name[:validation.MAX_NAME_LENGTH]
+        content = content[:validation.MAX_CONTENT_LENGTH]
+        if errors:
             return render_template('add_recipe.html.j2', name=name, content=content, image=image)
 
-        recipe_id = recipes_db.add_recipe(session['user_id'], name, content, image, image_type)
-
-        existing_tags = tags_db.get_all_tags()
-        tag_name_to_id = {tag['name']: tag['id'] for tag in existing_tags}
-        for tag in tags:
-            if tag not in tag_name_to_id:
-                tag_name_to_id[tag] = tags_db.add_tag(tag)
-            try:
-                tags_db.add_tag_to_recipe(recipe_id, tag_name_to_id[tag])
-            except sqlite3.IntegrityError:
-                pass  # Tag already added to recipe, ignore
+        image_hash = None
+        if image:
+            image_hash = images.store_image(image)
+            images.generate_variants_in_background(image_hash)
+        with db.transaction():
+            recipe_id = recipes_db.add_recipe(session['user_id'], name, content, image_hash, image_type)
+            tags_db.set_recipe_tags(recipe_id, tags)
 
         flash('Recipe added successfully.')
         return redirect('/')
 
-@app.route('/recipe/<int:recipe_id>')
-@app.route('/recipe/<int:recipe_id>/<int:page>')
-def show_recipe(recipe_id, page=1):
-    recipe = recipes_db.get_recipe_by_id(recipe_id)
+@app.route('/import', methods=['GET', 'POST'])
+def import_recipes():
+    if 'user_id' not in session:
+        return require_login()
+
+    if request.method == 'GET':
+        return render_template('import_recipes.html.j2')
+
+    check_csrf_token()
+    file = request.files.get('file')
+    if not file:
+        flash('ERROR: Choose an NDJSON file to import.')
+        return render_template('import_recipes.html.j2')
+    # Uploading the same file again continues an import that was cut off.
+    key = recipe_import.make_key(iter(lambda: file.stream.read(1024 * 1024), b''), session['user_id'])
+    file.stream.seek(0)
+    try:
+        progress, rejected = recipe_import.import_lines(io.TextIOWrapper(file.stream, encoding='utf-8'),
+                                                        session['user_id'], key)
+    except UnicodeDecodeError:
+        flash('ERROR: The file is not UTF-8 text.')
+        return render_template('import_recipes.html.j2')
+    flash(f'Imported {progress["recipes"]} recipes, rejected {progress["errors"]} lines.')
+    return render_template('import_recipes.html.j2', rejected=rejected[:config.IMPORT_ERRORS_SHOWN],
+                           rejected_count=len(rejected))
+
+def recipe_reviews(reviews, recipe_id, cursor, page, page_size):
+    # reviews is reviews_db or async_db.reviews, as in index_recipes().
+    if cursor:
+        key, page = cursor
+        if 'before' in request.args:
+            return reviews.get_reviews_for_recipe_seek(recipe_id, page_size, before=key)
+        return reviews.get_reviews_for_recipe_seek(recipe_id, page_size, after=key)
+    return reviews.get_reviews_for_recipe_paginated(recipe_id, max(page, 1), page_size)
+
+def render_recipe(recipe_id, page, cursor, recipe, reviews_count, reviews, user_review, page_size):
     if not recipe:
         flash('ERROR: Recipe not found.')
         return redirect('/')
 
-    page_size = 10
-    if page < 1:
-        page = 1
-    reviews_count = reviews_db.get_reviews_for_recipe_count(recipe_id)
     page_count = math.ceil(reviews_count / page_size)
     page_count = max(page_count, 1)
-    if page > page_count:
-        page = page_count
-    reviews = reviews_db.get_reviews_for_recipe_paginated(recipe_id, page, page_size)
+    if cursor:
+        page = min(max(cursor[1], 1), page_count)
+        if 'before' in request.args and len(reviews) < page_size:
+            return redirect(f'/recipe/{recipe_id}')
+        if 'before' not in request.args and not reviews:
+            return redirect(f'/recipe/{recipe_id}/{page_count}')
+    elif page > page_count:
+        return redirect(f'/recipe/{recipe_id}/{page_count}')
+    page = max(page, 1)
+    prev_cursor, next_cursor = pagination.cursors(reviews, page, page_count, lambda r: (r['created'], r['id']))
+
+    return render_template('recipe.html.j2', recipe=recipe, reviews=reviews, page=page, page_count=page_count, reviews_count=reviews_count, user_review=user_review, prev_cursor=prev_cursor, next_cursor=next_cursor)
+
+async def show_recipe_async(recipe_id, page=1):
+    page_size = 10
+    cursor = request_cursor()
+    if 'user_id' in session:
+        user_review_query = async_db.reviews.get_user_review_for_recipe(session['user_id'], recipe_id)
+    else:
+        user_review_query = asyncio.sleep(0)  # no user review to look up
+
+    recipe, reviews_count, reviews, user_review = await asyncio.gather(
+        async_db.recipes.get_recipe_by_id(recipe_id),
+        async_db.reviews.get_reviews_for_recipe_count(recipe_id),
+        recipe_reviews(async_db.reviews, recipe_id, cursor, page, page_size),
+        user_review_query)
+    return render_recipe(recipe_id, page, cursor, recipe, reviews_count, reviews, user_review, page_size)
 
+@app.route('/recipe/<int:recipe_id>')
+@app.route('/recipe/<int:recipe_id>/<int:page>')
+@page_cache.cached_page(lambda recipe_id, **kwargs: [f'version:recipe:{recipe_id}'])
+@async_variant(show_recipe_async)
+def show_recipe(recipe_id, page=1):
+    page_size = 10
+    cursor = request_cursor()
+    recipe = recipes_db.get_recipe_by_id(recipe_id)
+    reviews_count = reviews_db.get_reviews_for_recipe_count(recipe_id)
+    reviews = recipe_reviews(reviews_db, recipe_id, cursor, page, page_size)
     user_review = None
     if 'user_id' in session:
         user_review = reviews_db.get_user_review_for_recipe(session['user_id'], recipe_id)
+    return render_recipe(recipe_id, page, cursor, recipe, reviews_count, reviews, user_review, page_size)
 
-    return render_template('recipe.html.j2', recipe=recipe, reviews=reviews, page=page, page_count=page_count, reviews_count=reviews_count, user_review=user_review)
+def search_request(tag_cache, page, page_size):
+    # Returns the template arguments for an empty result and the arguments
+    # for search_page(), or None when no recipe can match.
+    tag_name_to_id = tag_cache['name_to_id']
+    query = request.args.get('query')
+    order = request.args.get('order', 'name')
+    match = request.args.get('match', 'any')
+    selected_tags = request.args.getlist('tags')
+    excluded_tags = request.args.getlist('exclude')
+    tag_ids = [tag_name_to_id[tag] for tag in selected_tags if tag in tag_name_to_id]
+    exclude_ids = [tag_name_to_id[tag] for tag in excluded_tags if tag in tag_name_to_id]
+    unknown_tags = len(tag_ids) < len(selected_tags)
+
+    page = max(page, 1)
+    context = {'query': query, 'order': order, 'match': match, 'recipes': [], 'page': page, 'page_count': 1,
+               'all_tags': tag_cache['tags'], 'recipe_count': 0, 'facets': None}
+    if (query or selected_tags or excluded_tags) and not (unknown_tags and (match == 'all' or not tag_ids)):
+        return context, (query, tag_ids, page, page_size, match, order, exclude_ids)
+    return context, None
+
+def render_search(context, results, page_size):
+    if results:
+        recipes, recipe_count, page, facets = results
+        page_count = max(math.ceil(recipe_count / page_size), 1)
+        context.update(recipes=recipes, recipe_count=recipe_count, page=page, page_count=page_count, facets=facets)
+    return render_template('search.html.j2', **context)
+
+async def search_async(page=1):
+    page_size = 10
+    context, search_args = search_request(await async_db.tags.get_tag_cache(), page, page_size)
+    results = await async_db.search.search_page(*search_args) if search_args else None
+    return render_search(context, results, page_size)
 
 @app.route('/search')
 @app.route('/search/<int:page>')
+@async_variant(search_async)
 def search(page=1):
-    all_tags = tags_db.get_all_tags()
-    tag_name_to_id = {tag['name']: tag['id'] for tag in all_tags}
-    query = request.args.get('query')
-    selected_tags = request.args.getlist('tags')
-    if selected_tags:
-        tag_ids = [tag_name_to_id[tag] for tag in selected_tags if tag in tag_name_to_id]
-    else:
-        tag_ids = [tag_name_to_id[tag] for tag in tag_name_to_id]
-
-    print(f'Search query: {query}, selected tags: {selected_tags}, tag IDs: {tag_ids}')
-    recipes = []
-    if page < 1:
-        page = 1
     page_size = 10
-    page_count = 1
-    recipe_count = 0
-    if query or selected_tags:
-        recipe_count = tags_db.get_recipe_count_filtered_by_tags(query, tag_ids)
-        page_count = math.ceil(recipe_count / page_size)
-        page_count = max(page_count, 1)
-        if page > page_count:
-            page = page_count
-        recipes = tags_db.search_recipes_filtered_by_tags_paginated(query, tag_ids, page, page_size)
-    return render_template('search.html.j2', query=query, recipes=recipes, page=page, page_count=page_count, all_tags=all_tags, recipe_count=recipe_count)
+    context, search_args = search_request(tags_db.get_tag_cache(), page, page_size)
+    results = search_db.search_page(*search_args) if search_args else None
+    return render_search(context, results, page_size)
 
 @app.route('/edit/<int:recipe_id>', methods=['GET', 'POST'])
 def edit_recipe(recipe_id):
@@ -235,57 +508,33 @@ def edit_recipe(recipe_id):
         name = request.form['name']
         content = request.form['content']
         file = request.files.get('image')
-        tags = request.form['tags'].casefold().replace(',', ' ').split()
+        tags = validation.parse_tags(request.form['tags'])
         image = None
         image_type = None
-        error_found = False
+        errors = []
 
         if file:
-            if not allowed_image(file.filename):
-                flash('ERROR: Invalid image file type.')
-                file = None
-                error_found = True
-            else:
-                image = file.read()
-                image_type = file.filename.rsplit('.', 1)[1].lower()
-                max_size = config.MAX_IMAGE_SIZE / (1024 * 1024)
-                if len(image) > config.MAX_IMAGE_SIZE:
-                    flash(f'ERROR: Image file size exceeds the maximum limit of {max_size:.2f} MB.')
-                    file, image, image_type = None, None, None
-                    error_found = True
-        if not name:
-            flash('ERROR: Recipe name is required.')
-            error_found = True
-        if len(name) > 100:
-            flash('ERROR: Recipe name is too long (maximum 100 characters).')
-            name = name[:100]
-            error_found = True
-        if len(content) > 5000:
-            flash('ERROR: Recipe content is too long (maximum 5000 characters).')
-            content = content[:5000]
-            error_found = True
-        if error_found:
+            image, image_type, image_errors = read_image(file)
+            errors += image_errors
+        errors += validation.recipe_errors(name, content)
+        for error in errors:
+            flash('ERROR: ' + error)
+        name = name[:validation.MAX_NAME_LENGTH]
+        content = content[:validation.MAX_CONTENT_LENGTH]
+        if errors:
             recipe = {'id': recipe_id, 'name': name, 'content': content, 'image': image}
             return render_template('edit_recipe.html.j2', recipe=recipe)
 
         if 'save' in request.form:
-            recipes_db.update_recipe(recipe_id, name, content, image, image_type)
-            existing_tags = tags_db.get_all_tags()
-            tag_name_to_id = {tag['name']: tag['id'] for tag in existing_tags}
-            tags_before = tags_db.get_tags_for_recipe(recipe_id)
-            tag_names_before = [tag['name'] for tag in tags_before]
-            for tag in tag_names_before:
-                if tag not in tags:
-                    tags_db.remove_tag_from_recipe(recipe_id, tag_name_to_id[tag])
-                    if not tags_db.is_tag_used(tag_name_to_id[tag]):
-                        tags_db.delete_tag(tag_name_to_id[tag])
-            for tag in tags:
-                if tag not in tag_name_to_id:
-                    tag_name_to_id[tag] = tags_db.add_tag(tag)
-                try:
-                    tags_db.add_tag_to_recipe(recipe_id, tag_name_to_id[tag])
-                except sqlite3.IntegrityError:
-                    pass  # Tag already added to recipe, ignore
+            image_hash = None
+            if image:
+                image_hash = images.store_image(image)
+                images.generate_variants_in_background(image_hash)
+            with db.transaction():
+                recipes_db.update_recipe(recipe_id, name, content, image_hash, image_type)
+                tags_db.set_recipe_tags(recipe_id, tags)
+            if recipe['image_hash'] != image_hash:
+                recipes_db.delete_image_if_unused(recipe['image_hash'])
             flash('Recipe updated successfully.')
         return redirect('/recipe/' + str(recipe_id))
 
@@ -307,32 +556,47 @@ def remove_recipe(recipe_id):
     if request.method == 'POST':
         check_csrf_token()
         if 'continue' in request.form:
-            used_tags = tags_db.get_tags_for_recipe(recipe_id)
-            recipes_db.delete_recipe(recipe_id)
-            for tag in used_tags:
-                if not tags_db.is_tag_used(tag['id']):
-                    tags_db.delete_tag(tag['id'])
+            with db.transaction():
+                used_tags = tags_db.get_tags_for_recipe(recipe_id)
+                recipes_db.delete_recipe(recipe_id)
+                tags_db.delete_unused_tags([tag['id'] for tag in used_tags])
+            recipes_db.delete_image_if_unused(recipe['image_hash'])
             flash('Recipe removed successfully.')
         return redirect('/')
 
 @app.route('/user/<username>')
 @app.route('/user/<username>/<int:page>')
+@page_cache.cached_page(lambda **kwargs: ['version:global'])
 def show_user(username, page=1):
     user = users_db.get_user(username)
     if not user:
         flash('ERROR: User not found.')
         return redirect('/')
-    if page < 1:
-        page = 1
     page_size = 10
     recipe_count = users_db.get_user_recipe_count(user['id'])
     page_count = math.ceil(recipe_count / page_size)
     page_count = max(page_count, 1)
-    if page > page_count:
-        page = page_count
-    recipes = users_db.get_user_recipes_paginated(user['id'], page, page_size)
+    cursor = pagination.decode_cursor(request.args.get('after') or request.args.get('before'))
+    if cursor:
+        key, page = cursor
+        page = min(max(page, 1), page_count)
+        if 'before' in request.args:
+            recipes = users_db.get_user_recipes_seek(user['id'], page_size, before=key)
+            if len(recipes) < page_size:
+                return redirect(f'/user/{username}')
+        else:
+            recipes = users_db.get_user_recipes_seek(user['id'], page_size, after=key)
+            if not recipes:
+                return redirect(f'/user/{username}/{page_count}')
+    else:
+        if page < 1:
+            page = 1
+        if page > page_count:
+            page = page_count
+        recipes = users_db.get_user_recipes_paginated(user['id'], page, page_size)
+    prev_cursor, next_cursor = pagination.cursors(recipes, page, page_count, lambda r: (r['name'], r['id']))
     user_reviews = reviews_db.get_user_reviews(user['id'])
-    return render_template('user.html.j2', username=username, recipes=recipes, page=page, page_count=page_count, recipe_count=recipe_count, user_reviews=user_reviews)
+    return render_template('user.html.j2', username=username, recipes=recipes, page=page, page_count=page_count, recipe_count=recipe_count, user_reviews=user_reviews, prev_cursor=prev_cursor, next_cursor=next_cursor)
 
 @app.route('/add_review/<int:recipe_id>', methods=['POST'])
 def add_review(recipe_id):
@@ -416,26 +680,200 @@ def delete_review(recipe_id):
     flash('Your review has been deleted.')
     return redirect('/recipe/' + str(recipe_id))
 
+def image_variant_size(image_data):
+    # The requested variant width, if the recipe has an image to resize.
+    size = request.args.get('size')
+    if image_data and image_data['image_hash'] and size in config.IMAGE_VARIANT_WIDTHS:
+        return size
+    return None
+
+def recipe_image_response(image_data, size, has_variant):
+    if not image_data or not image_data['image_hash']:
+        flash('ERROR: Image not found.')
+        return redirect('/')
+
+    image_hash, image_type = image_data['image_hash'], image_data['image_type']
+    versioned = request.args.get('v') == image_hash
+    path, etag = images.image_path(image_hash), image_hash
+    if size:
+        if has_variant:
+            path, etag = images.variant_path(image_hash, size), f'{image_hash}-{size}'
+        else:
+            versioned = False  # serve the original until the variant is ready
+    return image_response(path, image_type, etag, versioned)
+
+async def serve_image_async(recipe_id):
+    image_data = await async_db.recipes.get_recipe_image(recipe_id)
+    size = image_variant_size(image_data)
+    has_variant = size and await async_db.run(images.has_variant, image_data['image_hash'], size)
+    return recipe_image_response(image_data, size, has_variant)
+
 @app.route('/image/<int:recipe_id>')
+@async_variant(serve_image_async)
 def serve_image(recipe_id):
     image_data = recipes_db.get_recipe_image(recipe_id)
-    if not image_data:
-        flash('ERROR: Image not found.')
-        return redirect('/')
+    size = image_variant_size(image_data)
+    has_variant = size and images.has_variant(image_data['image_hash'], size)
+    return recipe_image_response(image_data, size, has_variant)
+
+def image_response(path, image_type, etag, versioned):
+    response = send_file(path,
+                         mimetype=images.mimetype(image_type),
+                         etag=etag,
+                         conditional=True,
+                         max_age=config.IMAGE_CACHE_MAX_AGE if versioned else 0)
+    if versioned:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
 
-    image, image_type = image_data['image'], image_data['image_type']
-    response = make_response(bytes(image))
-    response.headers.set('Content-Type', f'image/{image_type}')
+@app.route('/stats/page_cache')
+def page_cache_stats():
+    return page_cache.stats()
+
+@app.route('/stats/suggest')
+def suggest_stats():
+    return suggest_index.stats()
+
+@app.route('/api/suggest')
+def suggest():
+    prefix = request.args.get('q', '').strip()
+    limit = request.args.get('limit', config.SUGGEST_LIMIT, type=int)
+    limit = min(max(limit, 1), config.SUGGEST_MAX_LIMIT)
+    if not prefix:
+        return {'recipes': [], 'tags': [], 'users': []}
+    found = suggest_index.suggest(prefix, limit)
+    return {
+        'recipes': [{'id': recipe_id, 'name': name} for recipe_id, name in found['recipes']],
+        'tags': [{'id': tag_id, 'name': name} for tag_id, name in found['tags']],
+        'users': [{'id': user_id, 'username': name} for user_id, name in found['users']],
+    }
+
+API_RECIPE_FIELDS = ['id', 'name', 'content', 'user_id', 'username', 'created', 'modified',
+                     'avg_rating', 'review_count', 'tags', 'image_url']
+API_DEFAULT_FIELDS = ['id', 'name', 'username', 'created', 'modified', 'avg_rating', 'review_count', 'tags']
+
+def api_error(message, status=400):
+    return {'error': message}, status
+
+def parse_api_ids():
+    try:
+        ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        return None
+    return list(dict.fromkeys(ids))
+
+def api_recipe_versions(**kwargs):
+    ids = parse_api_ids() or []
+    if len(ids) > config.API_MAX_IDS:
+        return []
+    return [f'version:recipe:{recipe_id}' for recipe_id in ids] + ['tag_generation', 'user_generation']
+
+def get_api_recipes(ids, fields):
+    # One statement per table for the whole batch: recipes (with
+    # recipe_stats), users and recipe_tags.
+    columns = [field for field in fields if field in recipes_db.RECIPE_FIELDS]
+    if 'username' in fields:
+        columns.append('user_id')
+    if 'image_url' in fields:
+        columns.append('image_hash')
+    rows = {row['id']: row for row in recipes_db.get_recipe_fields(ids, list(dict.fromkeys(columns)))}
+    found = [recipe_id for recipe_id in ids if recipe_id in rows]
+    usernames = users_db.get_usernames({rows[recipe_id]['user_id'] for recipe_id in found}) if 'username' in fields else {}
+    tags = tags_db.get_tag_names_for_recipes(found) if 'tags' in fields else {}
+    recipes = []
+    for recipe_id in found:
+        row = rows[recipe_id]
+        recipe = {}
+        for field in fields:
+            if field == 'username':
+                recipe[field] = usernames.get(row['user_id'])
+            elif field == 'tags':
+                recipe[field] = tags[recipe_id]
+            elif field == 'image_url':
+                recipe[field] = f'/image/{recipe_id}?v={row["image_hash"]}' if row['image_hash'] else None
+            else:
+                recipe[field] = row[field]
+        recipes.append(recipe)
+    return recipes, [recipe_id for recipe_id in ids if recipe_id not in rows]
+
+@app.route('/api/recipes')
+@page_cache.cached_page(api_recipe_versions, mimetype='application/json')
+def api_recipes():
+    ids = parse_api_ids()
+    if not ids:
+        return api_error('ids must be a comma-separated list of recipe ids')
+    if len(ids) > config.API_MAX_IDS:
+        return api_error(f'at most {config.API_MAX_IDS} ids per request')
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    fields = list(dict.fromkeys(['id'] + fields)) if fields else API_DEFAULT_FIELDS
+    unknown = [field for field in fields if field not in API_RECIPE_FIELDS]
+    if unknown:
+        return api_error(f'unknown fields: {", ".join(unknown)}; choose from {", ".join(API_RECIPE_FIELDS)}')
+    recipes, missing = get_api_recipes(ids, fields)
+    return json.dumps({'recipes': recipes, 'missing': missing})
+
+@app.route('/api/recipes/<int:recipe_id>/reviews')
+@page_cache.cached_page(lambda recipe_id, **kwargs: [f'version:recipe:{recipe_id}', 'user_generation'],
+                        mimetype='application/json')
+def api_recipe_reviews(recipe_id):
+    if not recipes_db.get_recipe_fields([recipe_id], ['id']):
+        return api_error('recipe not found', 404)
+    limit = request.args.get('limit', config.API_REVIEW_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), config.API_REVIEW_PAGE_SIZE)
+    token = request.args.get('cursor')
+    cursor = pagination.decode_cursor(token)
+    if token and not cursor:
+        return api_error('invalid cursor')
+    key, page = cursor or (None, 1)
+    # One row more than the page tells whether there is a next page.
+    reviews = reviews_db.get_reviews_for_recipe_seek(recipe_id, limit + 1, after=key)
+    next_cursor = None
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        next_cursor = pagination.encode_cursor((reviews[-1]['created'], reviews[-1]['id']), page + 1)
+    return json.dumps({
+        'reviews': [{'id': review['id'],
+                     'user_id': review['user_id'],
+                     'username': review['username'],
+                     'rating': review['rating'],
+                     'comment': review['comment'],
+                     'created': review['created'],
+                     'modified': review['modified']} for review in reviews],
+        'next_cursor': next_cursor,
+    })
+
+@app.route('/export/<any(recipes, reviews, users):table>.ndjson')
+def export_table(table):
+    compress = 'gzip' in request.accept_encodings
+    response = Response(stream_with_context(export.stream(table, compress)), mimetype='application/x-ndjson')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Disposition'] = f'attachment; filename={table}.ndjson'
+    response.vary.add('Accept-Encoding')
     return response
 
+@app.route('/metrics')
+def show_metrics():
+    return metrics.render(page_cache.stats()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 def require_login():
     if 'user_id' not in session:
         flash('ERROR: You must be logged in to view this page.')
         return redirect('/login')
 
-def allowed_image(filename):
-    return ('.' in filename and
-            filename.rsplit('.', 1)[1].lower() in config.ALLOWED_IMAGE_EXTENSIONS)
+def read_image(file):
+    # The extension is checked before the upload is read, and at most one
+    # byte more than MAX_IMAGE_SIZE is read.
+    errors = validation.image_type_errors(file.filename)
+    if errors:
+        return None, None, errors
+    image = file.read(config.MAX_IMAGE_SIZE + 1)
+    errors = validation.image_size_errors(image)
+    if errors:
+        return None, None, errors
+    return image, validation.image_type(file.filename), []
 
 @app.template_filter()
 def show_lines(content):
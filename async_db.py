@@ -0,0 +1,60 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import config
+import db
+import recipes_db
+import reviews_db
+import search_db
+import tags_db
+import users_db
+
+_executor = None
+_executor_lock = threading.Lock()
+_thread = threading.local()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.DB_ASYNC_WORKERS, thread_name_prefix='db')
+    return _executor
+
+def call(database, function, args, kwargs):
+    # Pool threads keep their connections between calls; reopen them when
+    # the configured database has changed since.
+    if getattr(_thread, 'database', None) != database:
+        db.close_thread_connection()
+        _thread.database = database
+    current = db.state()
+    current.db_statements = 0
+    current.db_statement_time = 0
+    result = function(*args, **kwargs)
+    return result, current.db_statements, current.db_statement_time
+
+async def run(function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    result, statements, statement_time = await loop.run_in_executor(
+        get_executor(), call, config.DATABASE, function, args, kwargs)
+    # Count the statements towards the request like synchronous calls.
+    current = db.state()
+    current.db_statements = getattr(current, 'db_statements', 0) + statements
+    current.db_statement_time = getattr(current, 'db_statement_time', 0) + statement_time
+    return result
+
+class AsyncModule:
+    def __init__(self, module):
+        self.module = module
+
+    def __getattr__(self, name):
+        function = getattr(self.module, name)
+
+        async def wrapper(*args, **kwargs):
+            return await run(function, *args, **kwargs)
+        return wrapper
+
+recipes = AsyncModule(recipes_db)
+reviews = AsyncModule(reviews_db)
+search = AsyncModule(search_db)
+tags = AsyncModule(tags_db)
+users = AsyncModule(users_db)
@@ -0,0 +1,48 @@
+import argparse
+import time
+import config
+import db
+from app import app
+from benchmarks import common
+
+def counting(query, counter):
+    def wrapper(sql, params=()):
+        counter[0] += 1
+        return query(sql, params)
+    return wrapper
+
+def measure(client, paths, counter):
+    counter[0] = 0
+    start = time.perf_counter()
+    with common.quiet():
+        for path in paths:
+            assert client.get(path).status_code == 200, path
+    return time.perf_counter() - start, counter[0]
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare fetching recipes page by page with the batched JSON API.')
+    parser.add_argument('--recipes', type=int, default=500, help='recipes to fetch')
+    parser.add_argument('--batch', type=int, default=100, help='ids per /api/recipes request')
+    args = parser.parse_args()
+
+    config.PAGE_CACHE_ENABLED = False
+    path = common.create_database(recipe_count=max(args.recipes, 1000))
+    common.use_database(path)
+    counter = [0]
+    db.query = counting(db.query, counter)
+    try:
+        client = app.test_client()
+        ids = list(range(1, args.recipes + 1))
+        pages = [f'/recipe/{recipe_id}' for recipe_id in ids]
+        batches = ['/api/recipes?ids=' + ','.join(map(str, ids[start:start + args.batch])) +
+                   '&fields=name,username,avg_rating,review_count,tags'
+                   for start in range(0, len(ids), args.batch)]
+        print(f'{"method":<14} {"requests":>8} {"queries":>8} {"seconds":>8}')
+        for name, paths in (('HTML pages', pages), ('/api/recipes', batches)):
+            elapsed, queries = measure(client, paths, counter)
+            print(f'{name:<14} {len(paths):>8} {queries:>8} {elapsed:>8.3f}')
+    finally:
+        common.remove_database(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import statistics
+import threading
+import time
+import config
+import db
+from app import app
+from benchmarks import common
+
+PATHS = ['/', '/recipe/{recipe_id}', '/search?query=recipe', '/image/{recipe_id}']
+
+def slow_query(query, delay):
+    # Stands in for a slow disk or a reader waiting on a lock: the thread
+    # sleeps without holding the GIL, as it would in SQLite I/O.
+    def wrapper(sql, params=()):
+        time.sleep(delay)
+        return query(sql, params)
+    return wrapper
+
+def client_thread(requests, timings, errors, lock):
+    client = app.test_client()
+    local = []
+    for path in requests:
+        start = time.perf_counter()
+        response = client.get(path)
+        local.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            with lock:
+                errors.append(f'{path} returned {response.status_code}')
+            return
+    with lock:
+        timings.extend(local)
+
+def run(async_views, args, recipe_count):
+    config.ASYNC_VIEWS = async_views
+    requests = [path.format(recipe_id=i % recipe_count + 1) for i, path in
+                enumerate(PATHS * (args.requests // len(PATHS)))]
+    timings = []
+    errors = []
+    lock = threading.Lock()
+    threads = [threading.Thread(target=client_thread, args=(requests[i::args.concurrency], timings, errors, lock))
+               for i in range(args.concurrency)]
+    start = time.perf_counter()
+    with common.quiet():
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise RuntimeError(errors[0])
+    timings.sort()
+    return len(timings) / elapsed, statistics.median(timings), timings[int(len(timings) * 0.95)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare synchronous and async views under concurrent requests.')
+    parser.add_argument('--concurrency', type=int, default=32, help='client threads')
+    parser.add_argument('--requests', type=int, default=800, help='requests per mode')
+    parser.add_argument('--delay', type=float, default=2, help='milliseconds added to every query')
+    args = parser.parse_args()
+
+    config.PAGE_CACHE_ENABLED = False
+    path = common.create_database()
+    common.use_database(path)
+    db.query = slow_query(db.query, args.delay / 1000)
+    try:
+        print(f'{"mode":<6} {"req/s":>8} {"median ms":>10} {"p95 ms":>8}')
+        for async_views in (False, True):
+            try:
+                throughput, median, p95 = run(async_views, args, 1000)
+            except RuntimeError as error:
+                print(f'{"async" if async_views else "sync":<6} failed: {error}')
+                continue
+            print(f'{"async" if async_views else "sync":<6} {throughput:>8.0f} {median * 1000:>10.1f} {p95 * 1000:>8.1f}')
+    finally:
+        common.remove_database(path)
+
+if __name__ == '__main__':
+    main()
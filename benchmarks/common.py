@@ -0,0 +1,52 @@
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import tempfile
+import config
+
+def create_database(recipe_count=1000, user_count=100, tag_count=20, reviews_per_recipe=10):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    con = sqlite3.connect(path)
+    with open('schema.sql', encoding='utf-8') as f:
+        con.executescript(f.read())
+    rng = random.Random(42)
+    con.executemany('INSERT INTO users (username, password_hash) VALUES (?, ?)',
+                    ((f'user{i}', f'hash{i}') for i in range(1, user_count + 1)))
+    con.executemany('INSERT INTO tags (name) VALUES (?)',
+                    ((f'tag{i}',) for i in range(1, tag_count + 1)))
+    con.executemany('INSERT INTO recipes (name, content, user_id) VALUES (?, ?, ?)',
+                    ((f'Recipe {i}', f'Content of recipe {i}.', rng.randint(1, user_count))
+                     for i in range(1, recipe_count + 1)))
+    con.executemany('INSERT INTO recipe_tags (recipe_id, tag_id) VALUES (?, ?)',
+                    ((i, tag_id) for i in range(1, recipe_count + 1)
+                     for tag_id in rng.sample(range(1, tag_count + 1), k=rng.randint(0, 3))))
+    con.executemany('INSERT INTO reviews (recipe_id, user_id, rating, comment) VALUES (?, ?, ?, ?)',
+                    ((i, user_id, rng.randint(1, 5), f'Review by user {user_id}')
+                     for i in range(1, recipe_count + 1)
+                     for user_id in rng.sample(range(1, user_count + 1),
+                                               k=min(reviews_per_recipe, user_count))))
+    con.commit()
+    con.close()
+    return path
+
+def use_database(path):
+    config.DATABASE = path
+
+def remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path + suffix)
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def login(client, user_id, username):
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['username'] = username
+        session['csrf_token'] = config.CSRF_TOKEN_KEY
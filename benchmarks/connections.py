@@ -0,0 +1,54 @@
+import time
+import config
+import db
+from app import app
+from benchmarks import common
+
+ROUTES = [
+    ('GET', '/', None),
+    ('GET', '/recipe/1', None),
+    ('GET', '/search?query=recipe', None),
+    ('GET', '/user/user1', None),
+    ('POST', '/edit/{recipe_id}', {'name': 'Edited', 'content': 'Edited content',
+                                   'tags': 'a b c d e f g h', 'save': '1'}),
+]
+
+def owner_of_recipe_1():
+    return db.query('SELECT u.id, u.username FROM recipes r, users u WHERE r.user_id = u.id AND r.id = 1')[0]
+
+def run(reuse, repeat):
+    config.DB_REUSE_CONNECTION = reuse
+    client = app.test_client()
+    with app.app_context():
+        owner = owner_of_recipe_1()
+    common.login(client, owner['id'], owner['username'])
+    results = []
+    for method, path, form in ROUTES:
+        path = path.format(recipe_id=1)
+        before = db.connections_opened
+        start = time.perf_counter()
+        for _ in range(repeat):
+            with common.quiet():
+                if method == 'GET':
+                    client.get(path)
+                else:
+                    client.post(path, data={**form, 'csrf_token': config.CSRF_TOKEN_KEY})
+        elapsed = time.perf_counter() - start
+        results.append((f'{method} {path}', (db.connections_opened - before) / repeat, elapsed / repeat))
+    return results
+
+def main(repeat=20):
+    path = common.create_database()
+    common.use_database(path)
+    try:
+        before = run(False, repeat)
+        after = run(True, repeat)
+    finally:
+        common.remove_database(path)
+    print(f'{"route":<30} {"conns before":>12} {"conns after":>12} {"ms before":>10} {"ms after":>10}')
+    for (route, conns_before, time_before), (_, conns_after, time_after) in zip(before, after):
+        print(f'{route:<30} {conns_before:>12.1f} {conns_after:>12.1f} '
+              f'{time_before * 1000:>10.2f} {time_after * 1000:>10.2f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import db
+import recipes_db
+import reviews_db
+import search_db
+import tags_db
+import users_db
+from benchmarks import common
+
+# recipes: (users, tags, review probability); about five reviews per recipe
+SCALES = {
+    1000: (100, 20, 0.05),
+    100000: (1000, 50, 0.005),
+    1000000: (10000, 100, 0.0005),
+}
+PAGE_SIZE = 10
+
+def seed_database(path, recipe_count):
+    user_count, tag_count, probability = SCALES[recipe_count]
+    subprocess.run([sys.executable, 'seed.py', '--database', path, '--recipes', str(recipe_count),
+                    '--users', str(user_count), '--tags', str(tag_count),
+                    '--review-probability', str(probability)],
+                   check=True, stdout=subprocess.DEVNULL)
+
+def pages(count):
+    last = max(1, (count + PAGE_SIZE - 1) // PAGE_SIZE)
+    return {'first': 1, 'middle': (last + 1) // 2, 'last': last}
+
+def seek_key(rows):
+    # key of the row just before a page, as the routes decode it from a cursor
+    return (rows[-1]['name'], rows[-1]['id']) if rows else None
+
+def review_seek_key(rows):
+    return (rows[-1]['created'], rows[-1]['id']) if rows else None
+
+def targets():
+    recipe_count = recipes_db.get_recipe_count()
+    user = db.query('''SELECT u.id, u.username, COUNT(*) AS count
+                       FROM recipes r, users u
+                       WHERE r.user_id = u.id
+                       GROUP BY u.id
+                       ORDER BY count DESC
+                       LIMIT 1''')[0]
+    tag = db.query('''SELECT tag_id AS id, COUNT(*) AS count
+                      FROM recipe_tags
+                      GROUP BY tag_id
+                      ORDER BY count DESC
+                      LIMIT 1''')[0]
+    reviewed = db.query('''SELECT recipe_id AS id, review_count AS count
+                           FROM recipe_stats
+                           ORDER BY review_count DESC
+                           LIMIT 1''')[0]
+    reviewer = db.query('''SELECT user_id AS id, COUNT(*) AS count
+                           FROM reviews
+                           WHERE user_id = ?''', (user['id'],))[0]
+    middle_id = recipe_count // 2 + 1
+    return {
+        'recipe_count': recipe_count,
+        'recipe_id': middle_id,
+        'user': user,
+        'tag_id': tag['id'],
+        'tag_ids': [row['id'] for row in db.query('SELECT id FROM tags ORDER BY id LIMIT 3')],
+        'tag_count': tag['count'],
+        'reviewed_id': reviewed['id'],
+        'review_count': reviewed['count'],
+        'user_review_count': reviewer['count'],
+        'queries': {'selective': str(middle_id), 'unselective': 'recipe'},
+    }
+
+def cases(t):
+    user_id, username = t['user']['id'], t['user']['username']
+    tag_id, tag_ids = t['tag_id'], t['tag_ids']
+    reviewed_id = t['reviewed_id']
+    result = [
+        ('recipes_db.get_recipe_count', recipes_db.get_recipe_count),
+        ('recipes_db.get_all_recipes', recipes_db.get_all_recipes),
+        ('recipes_db.get_recipe_by_id', lambda: recipes_db.get_recipe_by_id(t['recipe_id'])),
+        ('recipes_db.get_recipe_image', lambda: recipes_db.get_recipe_image(t['recipe_id'])),
+        ('tags_db.get_all_tags', tags_db.get_all_tags),
+        ('tags_db.get_tag_generation', tags_db.get_tag_generation),
+        ('tags_db.get_tags_for_recipe', lambda: tags_db.get_tags_for_recipe(t['recipe_id'])),
+        ('tags_db.get_recipes_for_tag', lambda: tags_db.get_recipes_for_tag(tag_id)),
+        ('tags_db.get_recipes_for_tags', lambda: tags_db.get_recipes_for_tags(tag_ids)),
+        ('tags_db.get_recipe_count_for_tag', lambda: tags_db.get_recipe_count_for_tag(tag_id)),
+        ('tags_db.is_tag_used', lambda: tags_db.is_tag_used(tag_id)),
+        ('reviews_db.get_reviews_for_recipe_count', lambda: reviews_db.get_reviews_for_recipe_count(reviewed_id)),
+        ('reviews_db.get_average_rating_for_recipe', lambda: reviews_db.get_average_rating_for_recipe(reviewed_id)),
+        ('reviews_db.get_user_review_for_recipe', lambda: reviews_db.get_user_review_for_recipe(user_id, reviewed_id)),
+        ('reviews_db.get_user_reviews', lambda: reviews_db.get_user_reviews(user_id)),
+        ('reviews_db.get_user_review_count', lambda: reviews_db.get_user_review_count(user_id)),
+        ('users_db.get_user', lambda: users_db.get_user(username)),
+        ('users_db.get_user_recipes', lambda: users_db.get_user_recipes(user_id)),
+        ('users_db.get_user_recipe_count', lambda: users_db.get_user_recipe_count(user_id)),
+    ]
+
+    for name, page in pages(t['recipe_count']).items():
+        after = seek_key(recipes_db.get_recipes(page - 1, PAGE_SIZE)) if page > 1 else None
+        result += [
+            (f'recipes_db.get_recipes[{name}]', lambda page=page: recipes_db.get_recipes(page, PAGE_SIZE)),
+            (f'recipes_db.get_recipes_seek[{name}]',
+             lambda after=after: recipes_db.get_recipes_seek(PAGE_SIZE, after=after)),
+        ]
+    for name, page in pages(t['user']['count']).items():
+        after = seek_key(users_db.get_user_recipes_paginated(user_id, page - 1, PAGE_SIZE)) if page > 1 else None
+        result += [
+            (f'users_db.get_user_recipes_paginated[{name}]',
+             lambda page=page: users_db.get_user_recipes_paginated(user_id, page, PAGE_SIZE)),
+            (f'users_db.get_user_recipes_seek[{name}]',
+             lambda after=after: users_db.get_user_recipes_seek(user_id, PAGE_SIZE, after=after)),
+        ]
+    for name, page in pages(t['tag_count']).items():
+        result.append((f'tags_db.get_recipes_for_tag_paginated[{name}]',
+                       lambda page=page: tags_db.get_recipes_for_tag_paginated(tag_id, page, PAGE_SIZE)))
+    for name, page in pages(t['review_count']).items():
+        after = (review_seek_key(reviews_db.get_reviews_for_recipe_seek(reviewed_id, (page - 1) * PAGE_SIZE))
+                 if page > 1 else None)
+        result += [
+            (f'reviews_db.get_reviews_for_recipe_paginated[{name}]',
+             lambda page=page: reviews_db.get_reviews_for_recipe_paginated(reviewed_id, page, PAGE_SIZE)),
+            (f'reviews_db.get_reviews_for_recipe_seek[{name}]',
+             lambda after=after: reviews_db.get_reviews_for_recipe_seek(reviewed_id, PAGE_SIZE, after=after)),
+        ]
+    for name, page in pages(t['user_review_count']).items():
+        result.append((f'reviews_db.get_user_reviews_paginated[{name}]',
+                       lambda page=page: reviews_db.get_user_reviews_paginated(user_id, page, PAGE_SIZE)))
+
+    for kind, query in t['queries'].items():
+        count = recipes_db.get_search_recipe_count(query)
+        tagged_count = search_db.get_search_count(query, tag_ids)
+        result += [
+            (f'recipes_db.search_recipes[{kind}]', lambda query=query: recipes_db.search_recipes(query)),
+            (f'recipes_db.search_recipes[{kind},rank]', lambda query=query: recipes_db.search_recipes(query, 'rank')),
+            (f'recipes_db.get_search_recipe_count[{kind}]',
+             lambda query=query: recipes_db.get_search_recipe_count(query)),
+            (f'tags_db.search_recipes_filtered_by_tags[{kind}]',
+             lambda query=query: tags_db.search_recipes_filtered_by_tags(query, tag_ids)),
+            (f'tags_db.get_recipe_count_filtered_by_tags[{kind}]',
+             lambda query=query: tags_db.get_recipe_count_filtered_by_tags(query, tag_ids)),
+            (f'search_db.get_search_count[{kind}]', lambda query=query: search_db.get_search_count(query, tag_ids)),
+            (f'search_db.get_search_count[{kind},all]',
+             lambda query=query: search_db.get_search_count(query, tag_ids, 'all')),
+        ]
+        for name, page in pages(count).items():
+            result.append((f'recipes_db.search_recipes_paginated[{kind},{name}]',
+                           lambda query=query, page=page:
+                           recipes_db.search_recipes_paginated(query, page, PAGE_SIZE)))
+        for name, page in pages(tagged_count).items():
+            result += [
+                (f'tags_db.search_recipes_filtered_by_tags_paginated[{kind},{name}]',
+                 lambda query=query, page=page:
+                 tags_db.search_recipes_filtered_by_tags_paginated(query, tag_ids, page, PAGE_SIZE)),
+                (f'search_db.search_recipes[{kind},{name}]',
+                 lambda query=query, page=page: search_db.search_recipes(query, tag_ids, page, PAGE_SIZE)),
+            ]
+    return result
+
+def measure(function, repeat, budget):
+    function()  # warm the page cache and the statement cache
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeat and (len(timings) < 3 or time.perf_counter() - started < budget):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {'median_ms': statistics.median(timings) * 1000,
+            'min_ms': min(timings) * 1000,
+            'runs': len(timings)}
+
+def run_scale(recipe_count, args):
+    if args.data_dir:
+        os.makedirs(args.data_dir, exist_ok=True)
+        path = os.path.join(args.data_dir, f'bench-{recipe_count}.db')
+        keep = True
+    else:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        keep = False
+    try:
+        if not keep or not os.path.exists(path):
+            print(f'Seeding {recipe_count} recipes...', file=sys.stderr)
+            seed_database(path, recipe_count)
+        common.use_database(path)
+        results = {}
+        for name, function in cases(targets()):
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = measure(function, args.repeat, args.budget)
+            print(f'{recipe_count:>8} {name:<70} {results[name]["median_ms"]:>10.3f} ms', file=sys.stderr)
+        db.close_thread_connection()
+        return results
+    finally:
+        if not keep:
+            common.remove_database(path)
+
+def run(args):
+    results = {}
+    for recipe_count in args.scales:
+        results[str(recipe_count)] = run_scale(recipe_count, args)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'page_size': PAGE_SIZE,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f'Wrote {args.output}')
+
+def compare(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)['results']
+    regressions = 0
+    print(f'{"scale":>8} {"case":<70} {"before ms":>10} {"after ms":>10} {"change":>8}')
+    for scale in sorted(set(baseline) & set(current), key=int):
+        for name in sorted(set(baseline[scale]) & set(current[scale])):
+            before = baseline[scale][name]['median_ms']
+            after = current[scale][name]['median_ms']
+            change = (after - before) / before if before else 0.0
+            # differences below the noise floor are not reported however large the ratio
+            regressed = change > args.threshold and after - before > args.min_ms
+            improved = change < -args.threshold and before - after > args.min_ms
+            if regressed or improved or args.verbose:
+                mark = ' REGRESSION' if regressed else ''
+                print(f'{scale:>8} {name:<70} {before:>10.3f} {after:>10.3f} {change:>+8.0%}{mark}')
+            regressions += regressed
+    print(f'{regressions} regression(s) above {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Time the *_db query functions on seeded databases.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='seed databases, time every case and write the results as JSON')
+    run_parser.add_argument('--scales', type=lambda value: [int(part) for part in value.split(',')],
+                            default=list(SCALES), help='comma-separated recipe counts, one of '
+                            + ', '.join(str(scale) for scale in SCALES))
+    run_parser.add_argument('--output', default='benchmark.json')
+    run_parser.add_argument('--repeat', type=int, default=20, help='timed runs per case')
+    run_parser.add_argument('--budget', type=float, default=2.0,
+                            help='stop repeating a case after this many seconds (at least three runs)')
+    run_parser.add_argument('--filter', help='only run cases whose name contains this text')
+    run_parser.add_argument('--data-dir', help='keep the seeded databases here and reuse them on later runs')
+
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help='relative slowdown of the median that counts as a regression')
+    compare_parser.add_argument('--min-ms', type=float, default=0.05,
+                                help='ignore absolute differences smaller than this')
+    compare_parser.add_argument('--verbose', action='store_true', help='list unchanged cases too')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        for scale in args.scales:
+            if scale not in SCALES:
+                parser.error(f'unknown scale {scale}')
+    return args
+
+def main():
+    args = parse_args()
+    if args.command == 'run':
+        run(args)
+        return 0
+    return compare(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
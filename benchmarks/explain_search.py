@@ -0,0 +1,70 @@
+import itertools
+import sys
+import db
+import recipes_db
+import search_db
+from app import app
+from benchmarks import common
+
+QUERIES = [None, 'recipe 1']
+TAG_SETS = [[], [1], [1, 2, 3]]
+MATCHES = ['any', 'all']
+ORDERS = ['name', 'rank']
+
+def plan(sql, params):
+    return [row['detail'] for row in db.query('EXPLAIN QUERY PLAN ' + sql, params)]
+
+def expected_ids(query, tag_ids, match):
+    ids = {row['id'] for row in db.query('SELECT id FROM recipes')}
+    if query:
+        ids &= {row['id'] for row in recipes_db.search_recipes(query) or []}
+    if tag_ids:
+        tagged = [{row['recipe_id'] for row in db.query('SELECT recipe_id FROM recipe_tags WHERE tag_id = ?', (tag_id,))}
+                  for tag_id in tag_ids]
+        ids &= set.intersection(*tagged) if match == 'all' else set.union(*tagged)
+    return ids
+
+def check(query, tag_ids, match, order):
+    problems = []
+    page_sql, params, count_sql, count_params = search_db.build_search(query, tag_ids, match, order)
+    details = plan(page_sql, params + [10, 0]) + plan(count_sql, count_params)
+    if any('FOR DISTINCT' in detail for detail in details):
+        problems.append('uses DISTINCT')
+    if any(detail.startswith('SCAN rt') for detail in details):
+        problems.append('scans recipe_tags')
+    if tag_ids and not any('idx_recipe_tags_tag_id' in detail for detail in details):
+        problems.append('does not use idx_recipe_tags_tag_id')
+    if not tag_ids and any('idx_recipe_tags_tag_id' in detail for detail in details):
+        problems.append('joins recipe_tags without a tag filter')
+    if query and not any('VIRTUAL TABLE INDEX' in detail for detail in details):
+        problems.append('does not use the full-text index')
+    expected = expected_ids(query, tag_ids, match)
+    if search_db.get_search_count(query, tag_ids, match) != len(expected):
+        problems.append('count differs from the expected result')
+    rows = search_db.search_recipes(query, tag_ids, 1, len(expected) + 1, match, order)
+    if {row['id'] for row in rows} != expected:
+        problems.append('rows differ from the expected result')
+    return details, problems
+
+def main():
+    path = common.create_database(recipe_count=2000)
+    common.use_database(path)
+    failed = 0
+    try:
+        with app.app_context():
+            db.execute('ANALYZE')
+            for query, tag_ids, match, order in itertools.product(QUERIES, TAG_SETS, MATCHES, ORDERS):
+                if not query and not tag_ids:
+                    continue
+                details, problems = check(query, tag_ids, match, order)
+                status = 'FAIL ' + ', '.join(problems) if problems else 'ok'
+                print(f'query={query!r} tags={tag_ids} match={match} order={order}: {status}')
+                for detail in details:
+                    print(f'    {detail}')
+                failed += bool(problems)
+    finally:
+        common.remove_database(path)
+    return failed
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,57 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+import db
+import export
+from benchmarks import common
+
+# Each export runs in a fresh process so that ru_maxrss is the peak of that
+# export alone. 'fetchall' builds the whole result with db.query() first, as
+# the list-returning functions do; 'iterate' streams it with db.iterate().
+
+def export_fetchall(table, output):
+    rows = db.query(export.EXPORTS[table])
+    for row in rows:
+        record = dict(row)
+        output.write((json.dumps(record, ensure_ascii=False) + '\n').encode())
+
+def export_iterate(table, output):
+    export.write(table, output)
+
+MODES = {'fetchall': export_fetchall, 'iterate': export_iterate}
+
+def run_export(path, table, mode):
+    common.use_database(path)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with open(os.devnull, 'wb') as output:
+        MODES[mode](table, output)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, (peak - before) / 1024  # ru_maxrss is in KiB on Linux
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure peak RSS of exporting tables with and without streaming.')
+    parser.add_argument('--scales', default='10000,50000', help='comma-separated recipe counts')
+    parser.add_argument('--tables', default='recipes,reviews')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    print(f'{"recipes":>8} {"table":<8} {"mode":<9} {"seconds":>8} {"peak RSS growth MiB":>20}')
+    for scale in map(int, args.scales.split(',')):
+        path = common.create_database(recipe_count=scale, reviews_per_recipe=5)
+        try:
+            for table in args.tables.split(','):
+                for mode in MODES:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        elapsed, growth = executor.submit(run_export, path, table, mode).result()
+                    print(f'{scale:>8} {table:<8} {mode:<9} {elapsed:>8.2f} {growth:>20.1f}')
+        finally:
+            common.remove_database(path)
+
+if __name__ == '__main__':
+    main()
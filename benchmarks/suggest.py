@@ -0,0 +1,123 @@
+import argparse
+import random
+import sqlite3
+import statistics
+import sys
+import time
+import tracemalloc
+import config
+import db
+import suggest_index
+from app import app
+from benchmarks import common
+
+WORDS = ['apple', 'banana', 'bean', 'beef', 'bread', 'cake', 'carrot', 'cheese', 'chicken', 'chili', 'curry',
+         'egg', 'fish', 'garlic', 'ginger', 'honey', 'lemon', 'lentil', 'mushroom', 'noodle', 'oat', 'onion',
+         'pasta', 'pea', 'pie', 'pork', 'potato', 'rice', 'salad', 'salmon', 'soup', 'spinach', 'stew',
+         'tofu', 'tomato', 'tuna', 'waffle', 'yogurt']
+
+def generate_names(count, rng):
+    return [f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {rng.choice(WORDS)} {i}' for i in range(count)]
+
+def expected(client, prefix, limit):
+    prefix = prefix.casefold()
+    result = {}
+    for kind, sql in (('recipes', 'SELECT id, name FROM recipes'), ('tags', 'SELECT id, name FROM tags'),
+                      ('users', 'SELECT id, username AS name FROM users')):
+        rows = sorted(((row['name'].casefold()[:config.SUGGEST_KEY_LENGTH], row['id'], row['name'])
+                       for row in db.query(sql)))
+        result[kind] = [name for _, _, name in rows if name.casefold().startswith(prefix)][:limit]
+    return result
+
+def check(client, prefixes, limit=5):
+    failed = 0
+    for prefix in prefixes:
+        with common.quiet():
+            data = client.get('/api/suggest', query_string={'q': prefix, 'limit': limit}).get_json()
+        got = {'recipes': [item['name'] for item in data['recipes']],
+               'tags': [item['name'] for item in data['tags']],
+               'users': [item['username'] for item in data['users']]}
+        want = expected(client, prefix, limit)
+        # names with the same key may come in either order
+        same = all(sorted(got[kind]) == sorted(want[kind]) for kind in got)
+        print(f'{prefix!r}: {"ok" if same else "FAIL"}')
+        failed += not same
+    return failed
+
+def check_endpoint():
+    path = common.create_database(recipe_count=2000)
+    common.use_database(path)
+    prefixes = ['r', 'recipe 1', 'Recipe 19', 'TAG1', 'user2', 'x', 'a']
+    try:
+        with app.app_context():
+            client = app.test_client()
+            failed = check(client, prefixes)
+            with db.transaction():
+                db.execute("INSERT INTO recipes (name, content, user_id) VALUES ('Apple pie', '', 1)")
+                db.execute("UPDATE recipes SET name = 'Apricot jam' WHERE id = 5")
+                db.execute('DELETE FROM recipes WHERE id = 19')
+                db.execute("INSERT INTO tags (name) VALUES ('apricot')")
+                db.execute("INSERT INTO users (username, password_hash) VALUES ('Ada', 'x')")
+            failed += check(client, ['a', 'ap', 'Recipe 19', 'recipe 5'])
+    finally:
+        common.remove_database(path)
+    return failed
+
+def timed_lookups(function, prefixes):
+    timings = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        function(prefix)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return statistics.median(timings) * 1000, timings[int(len(timings) * 0.99)] * 1000
+
+def benchmark(count, lookups):
+    rng = random.Random(42)
+    names = generate_names(count, rng)
+    tracemalloc.start()
+    start = time.perf_counter()
+    entries = suggest_index.Entries(enumerate(names, 1))
+    build_time = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'{count} names: built in {build_time:.2f}s, {memory / 2 ** 20:.1f} MiB '
+          f'(estimate {entries.memory() / 2 ** 20:.1f} MiB, budget {config.SUGGEST_MAX_MEMORY / 2 ** 20:.0f} MiB)')
+
+    con = sqlite3.connect(':memory:')
+    con.execute('CREATE TABLE recipes (id INTEGER PRIMARY KEY, name TEXT)')
+    con.executemany('INSERT INTO recipes (id, name) VALUES (?, ?)', enumerate(names, 1))
+    con.execute('CREATE INDEX idx_recipe_name ON recipes(name)')
+    print(f'{"prefix":<8} {"index median ms":>16} {"p99":>8} {"LIKE median ms":>15} {"p99":>8}')
+    for length in (1, 2, 4, 8):
+        prefixes = [name[:length] for name in rng.sample(names, lookups)]
+        index_times = timed_lookups(lambda prefix: entries.find(prefix, config.SUGGEST_LIMIT), prefixes)
+        like_times = timed_lookups(lambda prefix: con.execute('SELECT id FROM recipes WHERE name LIKE ? LIMIT ?',
+                                                              (prefix + '%', config.SUGGEST_LIMIT)).fetchall(),
+                                   prefixes[:max(lookups // 10, 1)])
+        print(f'{length:<8} {index_times[0]:>16.3f} {index_times[1]:>8.3f} {like_times[0]:>15.3f} {like_times[1]:>8.3f}')
+    con.close()
+
+    added = generate_names(lookups, rng)
+    start = time.perf_counter()
+    for offset, name in enumerate(added):
+        entries.add(count + 1 + offset, name)
+    add_time = (time.perf_counter() - start) / lookups
+    start = time.perf_counter()
+    for offset in range(lookups):
+        entries.remove(count + 1 + offset)
+    remove_time = (time.perf_counter() - start) / lookups
+    print(f'add {add_time * 1000:.3f} ms, remove {remove_time * 1000:.3f} ms per name')
+
+def main():
+    parser = argparse.ArgumentParser(description='Check /api/suggest and time the prefix index.')
+    parser.add_argument('--names', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    failed = check_endpoint()
+    benchmark(args.names, args.lookups)
+    return failed
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,101 @@
+import argparse
+import itertools
+import sys
+import time
+import config
+import db
+import search_db
+import tag_index
+from app import app
+from benchmarks import common
+
+QUERIES = [None, 'recipe 1']
+TAG_SETS = [[], [1], [1, 2, 3]]
+EXCLUDE_SETS = [[], [4], [4, 5]]
+MATCHES = ['any', 'all']
+ORDERS = ['name', 'rank']
+
+def sql_facets(query, tag_ids, match, exclude_ids):
+    _, _, count_sql, params = search_db.build_search(query, tag_ids, match, exclude_ids=exclude_ids)
+    facet_sql = count_sql.replace('COUNT(*) AS count', 'r.id')
+    return {row['tag_id']: row['count'] for row in
+            db.query(f'''SELECT rt.tag_id, COUNT(*) AS count
+                         FROM recipe_tags rt
+                         WHERE rt.recipe_id IN ({facet_sql})
+                         GROUP BY rt.tag_id''', params)}
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, (time.perf_counter() - start) / repeat
+
+def search(enabled, query, tag_ids, exclude_ids, match, order, page):
+    config.TAG_INDEX_ENABLED = enabled
+    recipes, recipe_count, page, facets = search_db.search_page(query, tag_ids, page, 10, match, order, exclude_ids)
+    return [recipe['id'] for recipe in recipes], recipe_count, page, facets
+
+def check(query, tag_ids, exclude_ids, match, order, repeat):
+    problems = []
+    timings = []
+    for page in (1, 3):
+        indexed, index_time = timed(lambda: search(True, query, tag_ids, exclude_ids, match, order, page), repeat)
+        expected, sql_time = timed(lambda: search(False, query, tag_ids, exclude_ids, match, order, page), repeat)
+        timings.append((index_time, sql_time))
+        if indexed[:3] != expected[:3]:
+            problems.append(f'page {page} differs from SQL')
+    facets = indexed[3]  # None past TAG_FACET_MAX_MATCHES
+    if facets is not None and ({tag_id: count for tag_id, count in facets.items() if count} !=
+                               sql_facets(query, tag_ids, match, exclude_ids)):
+        problems.append('facet counts differ from SQL')
+    return timings, problems
+
+def run_checks(repeat):
+    failed = 0
+    for query, tag_ids, exclude_ids, match, order in itertools.product(QUERIES, TAG_SETS, EXCLUDE_SETS,
+                                                                       MATCHES, ORDERS):
+        if match == 'all' and not tag_ids:
+            continue
+        timings, problems = check(query, tag_ids, exclude_ids, match, order, repeat)
+        status = 'FAIL ' + ', '.join(problems) if problems else 'ok'
+        times = ' '.join(f'{index * 1000:.2f}/{sql * 1000:.2f}' for index, sql in timings)
+        print(f'query={query!r} tags={tag_ids} exclude={exclude_ids} match={match} order={order}: '
+              f'index/SQL ms {times} {status}')
+        failed += bool(problems)
+    return failed
+
+def edit():
+    # Changes through the triggers in schema.sql, which the index has to
+    # pick up from tag_index_changes.
+    with db.transaction():
+        db.execute('DELETE FROM recipe_tags WHERE recipe_id IN (SELECT recipe_id FROM recipe_tags WHERE tag_id = 1 LIMIT 50)')
+        db.execute('INSERT OR IGNORE INTO recipe_tags (recipe_id, tag_id) SELECT id, 4 FROM recipes WHERE id % 7 = 0')
+        db.execute("UPDATE recipes SET name = 'A ' || name WHERE id % 11 = 0")
+        db.execute('DELETE FROM recipes WHERE id % 13 = 0')
+        db.execute("INSERT INTO recipes (name, content, user_id) VALUES ('Recipe new', 'Content', 1)")
+        db.execute('INSERT INTO recipe_tags (recipe_id, tag_id) VALUES (last_insert_rowid(), 1)')
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the in-memory tag index against the SQL search.')
+    parser.add_argument('--recipes', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per timing')
+    args = parser.parse_args()
+
+    config.PAGE_CACHE_ENABLED = False
+    path = common.create_database(recipe_count=args.recipes)
+    common.use_database(path)
+    try:
+        with app.app_context():
+            start = time.perf_counter()
+            tag_index.get_index()
+            print(f'Loaded the index in {(time.perf_counter() - start) * 1000:.1f} ms')
+            failed = run_checks(args.repeat)
+            edit()
+            print('After edits:')
+            failed += run_checks(1)
+    finally:
+        common.remove_database(path)
+    return failed
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
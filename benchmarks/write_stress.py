@@ -0,0 +1,113 @@
+import argparse
+import multiprocessing
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import config
+import db
+import recipes_db
+import reviews_db
+from benchmarks import common
+
+# 'direct' is the old behaviour: every thread writes on its own connection
+# and reads share it. 'queued' uses the read-only connections, the writer
+# thread and the retry policy from config.py.
+MODES = {
+    'direct': {'DB_READ_ONLY_CONNECTIONS': False, 'DB_WRITE_QUEUE': False, 'DB_WRITE_RETRIES': 0},
+    'queued': {},
+}
+
+def write_once(rng, review_count):
+    reviews_db.update_review(rng.randint(1, review_count), rng.randint(1, 5), f'Stress {rng.random()}')
+
+def read_once(rng, recipe_count):
+    recipe_id = rng.randint(1, recipe_count)
+    recipes_db.get_recipes(rng.randint(1, recipe_count // 10), 10)
+    recipes_db.get_recipe_by_id(recipe_id)
+    reviews_db.get_reviews_for_recipe_paginated(recipe_id)
+
+def run_thread(kind, seed, deadline, totals, lock):
+    rng = random.Random(seed)
+    recipe_count = recipes_db.get_recipe_count()
+    review_count = db.query('SELECT MAX(id) AS id FROM reviews')[0]['id']
+    done = locked = failed = 0
+    latency = 0.0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if kind == 'write':
+                write_once(rng, review_count)
+            else:
+                read_once(rng, recipe_count)
+        except sqlite3.OperationalError as error:
+            if 'locked' in str(error):
+                locked += 1
+            else:
+                failed += 1
+            continue
+        latency = max(latency, time.perf_counter() - start)
+        done += 1
+    db.close_thread_connection()
+    with lock:
+        totals[kind] += done
+        totals[f'{kind}_locked'] += locked
+        totals[f'{kind}_failed'] += failed
+        totals[f'{kind}_max_latency'] = max(totals[f'{kind}_max_latency'], latency)
+
+def run_process(path, settings, writers, readers, seconds, seed):
+    common.use_database(path)
+    for name, value in settings.items():
+        setattr(config, name, value)
+    totals = {f'{kind}{suffix}': 0 for kind in ('write', 'read')
+              for suffix in ('', '_locked', '_failed', '_max_latency')}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=run_thread, args=(kind, seed * 1000 + i, deadline, totals, lock))
+               for i, kind in enumerate(['write'] * writers + ['read'] * readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return totals
+
+def run(path, mode, args):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=args.processes, mp_context=context) as executor:
+        futures = [executor.submit(run_process, path, MODES[mode], args.writers, args.readers, args.seconds, seed)
+                   for seed in range(args.processes)]
+        results = [future.result() for future in futures]
+    totals = {name: sum(result[name] for result in results) for name in results[0]}
+    for kind in ('write', 'read'):
+        totals[f'{kind}_max_latency'] = max(result[f'{kind}_max_latency'] for result in results)
+    return totals
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run parallel writers and readers against one database file.')
+    parser.add_argument('--processes', type=int, default=4, help='worker processes, like gunicorn workers')
+    parser.add_argument('--writers', type=int, default=4, help='writer threads per process')
+    parser.add_argument('--readers', type=int, default=4, help='reader threads per process')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--recipes', type=int, default=2000)
+    parser.add_argument('--mode', choices=list(MODES), action='append',
+                        help='run only this mode (can be given twice); default is both')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    print(f'{"mode":<8} {"writes/s":>10} {"reads/s":>10} {"locked":>8} {"failed":>8} '
+          f'{"max write ms":>13} {"max read ms":>12}')
+    for mode in args.mode or list(MODES):
+        path = common.create_database(recipe_count=args.recipes)
+        try:
+            totals = run(path, mode, args)
+        finally:
+            common.remove_database(path)
+        print(f'{mode:<8} {totals["write"] / args.seconds:>10.0f} {totals["read"] / args.seconds:>10.0f} '
+              f'{totals["write_locked"] + totals["read_locked"]:>8} '
+              f'{totals["write_failed"] + totals["read_failed"]:>8} '
+              f'{totals["write_max_latency"] * 1000:>13.1f} {totals["read_max_latency"] * 1000:>12.1f}')
+
+if __name__ == '__main__':
+    main()
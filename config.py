@@ -4,3 +4,90 @@ SECRET_KEY = secrets.token_hex(16)
 CSRF_TOKEN_KEY = secrets.token_hex(16)
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 MAX_IMAGE_SIZE = 2 * 1024 * 1024  # 2 MB
+IMAGE_DIR = 'images'
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 60 * 60  # 1 year
+# Resized copies generated with Pillow, if it is installed: size -> max width
+IMAGE_VARIANT_WIDTHS = {'thumb': 200, 'medium': 800}
+IMAGE_WORKERS = 2
+
+DATABASE = 'database.db'
+# Keep one connection per request (stored on flask.g) or per thread outside
+# requests. Set to False to open a new connection for every statement.
+DB_REUSE_CONNECTION = True
+DB_STATEMENT_CACHE_SIZE = 256
+# query() reads through a separate read-only connection (mode=ro) that sees
+# the latest committed WAL snapshot; inside db.transaction() it uses the
+# transaction's connection.
+DB_READ_ONLY_CONNECTIONS = True
+DB_BUSY_TIMEOUT = 5  # seconds to wait for another process's write lock
+DB_WRITE_RETRIES = 3  # further attempts to BEGIN after the busy timeout
+DB_WRITE_RETRY_DELAY = 0.05  # seconds, doubled after every attempt
+# Single db.execute() calls outside a transaction are committed by one writer
+# thread per process, up to DB_WRITE_BATCH_SIZE statements per commit.
+DB_WRITE_QUEUE = True
+DB_WRITE_BATCH_SIZE = 50
+# Requests that run more SQL statements than this are logged as a likely N+1
+# query pattern and counted in /metrics.
+DB_STATEMENT_BUDGET = 30
+DB_ITERATE_ARRAYSIZE = 500  # rows fetched at a time by db.iterate()
+# db.iterate() reads each page once, so its connection gets a small page cache
+# and no memory map, whose pages would count towards the process's RSS.
+DB_ITERATE_PRAGMAS = {'cache_size': -2000, 'mmap_size': 0}
+# Largest IN (...) list that db.query_in() binds in one statement
+DB_IN_BATCH_SIZE = 500
+# Statements slower than this many seconds are written to the slow-query log
+# with their query plan. None turns the log off.
+DB_SLOW_QUERY_THRESHOLD = 0.1
+DB_SLOW_QUERY_LOG = 'slow_queries.log'
+DB_SLOW_QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024
+DB_SLOW_QUERY_LOG_BACKUPS = 3
+DB_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,  # 20 MB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# FTS5 tokenizer for recipe search. 'trigram' keeps the substring matching of
+# the old LIKE search; rebuild the index with 'flask build-search-index' after
+# changing this.
+SEARCH_TOKENIZER = 'unicode61 remove_diacritics 2'
+# Filter the search by tags and count the results per tag with an in-memory
+# bitmap index in each process (tag_index.py). False runs the tag filters as
+# SQL subqueries and shows no counts.
+TAG_INDEX_ENABLED = True
+# A text search without tag filters runs in SQL with LIMIT; its per-tag
+# counts are only computed when it matches at most this many recipes.
+TAG_FACET_MAX_MATCHES = 10000
+# Typeahead (/api/suggest) over recipe names, tag names and usernames. Names
+# are kept lowercased and cut to SUGGEST_KEY_LENGTH characters. When all
+# recipe names would not fit in SUGGEST_MAX_MEMORY bytes, the most reviewed
+# recipes are kept.
+SUGGEST_LIMIT = 8
+SUGGEST_MAX_LIMIT = 50
+SUGGEST_KEY_LENGTH = 32
+SUGGEST_MAX_MEMORY = 64 * 1024 * 1024
+# JSON API: most recipe ids per /api/recipes request and reviews per page
+API_MAX_IDS = 500
+API_REVIEW_PAGE_SIZE = 50
+# NDJSON exports (/export/<table>.ndjson, flask export) are sent in chunks of
+# about EXPORT_CHUNK_SIZE bytes, gzipped when the client accepts it.
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_GZIP_LEVEL = 6
+# Bulk import (flask import-recipes, /import): input lines per transaction
+# and rejected lines listed on the import page.
+IMPORT_BATCH_SIZE = 1000
+IMPORT_ERRORS_SHOWN = 100
+
+# Run index, recipe, search and image routes as async views that await
+# independent queries concurrently. Needs Flask's async extra:
+# pip install "flask[async]"
+ASYNC_VIEWS = False
+DB_ASYNC_WORKERS = 8  # threads running the async views' queries
+
+# Rendered pages for anonymous visitors, keyed by the version counters that
+# the triggers in schema.sql bump on every write.
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_MAX_SIZE = 32 * 1024 * 1024  # characters of rendered HTML
+PAGE_CACHE_TTL = 300  # seconds
@@ -0,0 +1,56 @@
+import db
+
+def get_counter(name):
+    sql = '''SELECT value
+             FROM counters
+             WHERE name = ?'''
+    result = db.query(sql, (name,))
+    return result[0]['value'] if result else 0
+
+def get_counters(names):
+    placeholders = ','.join('?' for _ in names)
+    sql = f'''SELECT name,
+                     value
+              FROM counters
+              WHERE name IN ({placeholders})'''
+    values = {row['name']: row['value'] for row in db.query(sql, names)}
+    return tuple(values.get(name, 0) for name in names)
+
+def get_expected_counters():
+    sql = '''SELECT 'recipes' AS name,
+                    COUNT(*) AS value
+             FROM recipes
+             UNION ALL
+             SELECT 'user_recipes:' || r.user_id,
+                    COUNT(*)
+             FROM recipes r
+             GROUP BY r.user_id
+             UNION ALL
+             SELECT 'tag_recipes:' || rt.tag_id,
+                    COUNT(*)
+             FROM recipe_tags rt
+             GROUP BY rt.tag_id'''
+    return {row['name']: row['value'] for row in db.query(sql)}
+
+def get_stored_counters():
+    sql = '''SELECT name,
+                    value
+             FROM counters
+             WHERE name = 'recipes' OR
+                   name LIKE 'user_recipes:%' OR
+                   name LIKE 'tag_recipes:%'
+             ORDER BY name'''
+    return {row['name']: row['value'] for row in db.query(sql)}
+
+def check_counters(repair=False):
+    expected = get_expected_counters()
+    stored = get_stored_counters()
+    mismatches = {name: (stored.get(name, 0), expected.get(name, 0))
+                  for name in expected.keys() | stored.keys()
+                  if stored.get(name, 0) != expected.get(name, 0)}
+    if repair and mismatches:
+        sql = '''INSERT INTO counters (name, value)
+                 VALUES (?, ?)
+                 ON CONFLICT(name) DO UPDATE SET value = excluded.value'''
+        db.execute_many(sql, [(name, values[1]) for name, values in mismatches.items()])
+    return mismatches
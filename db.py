@@ -1,24 +1,368 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
 import sqlite3
-from flask import g
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from flask import g, has_app_context, has_request_context, request
+import config
+import metrics
 
-def get_connection():
-    con = sqlite3.connect('database.db')
-    con.execute('PRAGMA foreign_keys = ON')
+_local = threading.local()
+connections_opened = 0
+slow_log = logging.getLogger('slow_queries')
+_slow_lock = threading.Lock()
+_slow_seen = set()
+# Set to a dict to collect {sql: params} of every statement run (see
+# index_advisor).
+statement_log = None
+# Writes within one process take turns; other processes wait on SQLite's own
+# lock for up to DB_BUSY_TIMEOUT.
+_write_lock = threading.Lock()
+_write_queue = queue.Queue()
+_writer = None
+_writer_start_lock = threading.Lock()
+
+def connect(readonly=False, database=None):
+    global connections_opened
+    database = database or config.DATABASE
+    if readonly:
+        uri = 'file:' + urllib.parse.quote(os.path.abspath(database)) + '?mode=ro'
+        con = sqlite3.connect(uri, uri=True,
+                              timeout=config.DB_BUSY_TIMEOUT,
+                              cached_statements=config.DB_STATEMENT_CACHE_SIZE)
+    else:
+        con = sqlite3.connect(database,
+                              timeout=config.DB_BUSY_TIMEOUT,
+                              cached_statements=config.DB_STATEMENT_CACHE_SIZE)
+        con.execute('PRAGMA foreign_keys = ON')
+    for name, value in config.DB_PRAGMAS.items():
+        if readonly and name == 'journal_mode':
+            continue  # only a writer can change it; WAL mode is stored in the file
+        con.execute(f'PRAGMA {name} = {value}')
     con.row_factory = sqlite3.Row
+    connections_opened += 1
+    return con
+
+def state():
+    return g if has_app_context() else _local
+
+def get_connection(readonly=False):
+    transaction_con = getattr(state(), 'db_transaction', None)
+    if transaction_con is not None:
+        return transaction_con
+    readonly = readonly and config.DB_READ_ONLY_CONNECTIONS
+    if not config.DB_REUSE_CONNECTION:
+        return connect(readonly)
+    current = state()
+    name = 'db_read' if readonly else 'db'
+    con = getattr(current, name, None)
+    if con is None:
+        con = connect(readonly)
+        setattr(current, name, con)
     return con
 
+def release_connection(con):
+    if not config.DB_REUSE_CONNECTION and con is not getattr(state(), 'db_transaction', None):
+        con.close()
+
+def close_connection(exception=None):
+    if not has_app_context():
+        return
+    for name in ('db', 'db_read'):
+        con = g.pop(name, None)
+        if con is not None:
+            con.close()
+
+def close_thread_connection():
+    for name in ('db', 'db_read'):
+        con = getattr(_local, name, None)
+        if con is not None:
+            con.close()
+            setattr(_local, name, None)
+
+def begin(con):
+    for attempt in range(config.DB_WRITE_RETRIES + 1):
+        try:
+            con.execute('BEGIN IMMEDIATE')
+            return
+        except sqlite3.OperationalError as error:
+            if 'locked' not in str(error) or attempt == config.DB_WRITE_RETRIES:
+                raise
+        time.sleep(config.DB_WRITE_RETRY_DELAY * 2 ** attempt)
+
+def write_batch(con, jobs):
+    # Every statement gets a savepoint, so a failing one (e.g. a UNIQUE
+    # violation) is reported to its caller without undoing the others.
+    results = []
+    try:
+        with _write_lock:
+            begin(con)
+            for _, sql, params, many, future in jobs:
+                con.execute('SAVEPOINT job')
+                try:
+                    cursor = con.executemany(sql, params) if many else con.execute(sql, params)
+                    results.append((future, cursor.lastrowid, None))
+                except Exception as error:
+                    con.execute('ROLLBACK TO job')
+                    results.append((future, None, error))
+                con.execute('RELEASE job')
+            con.commit()
+    except BaseException as error:
+        if con.in_transaction:
+            con.rollback()
+        for job in jobs:
+            job[-1].set_exception(error)
+        return
+    for future, result, error in results:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+def run_writer():
+    con = con_database = None
+    while True:
+        batch = [_write_queue.get()]
+        while len(batch) < config.DB_WRITE_BATCH_SIZE:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+        for database in dict.fromkeys(job[0] for job in batch):
+            jobs = [job for job in batch if job[0] == database]
+            try:
+                if con_database != database:
+                    if con is not None:
+                        con.close()
+                    con = con_database = None
+                    con = connect(database=database)
+                    con_database = database
+            except Exception as error:
+                for job in jobs:
+                    job[-1].set_exception(error)
+                continue
+            write_batch(con, jobs)
+
+def submit_write(sql, params, many=False):
+    global _writer
+    with _writer_start_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=run_writer, name='db-writer', daemon=True)
+            _writer.start()
+    future = Future()
+    _write_queue.put((config.DATABASE, sql, list(params) if many else params, many, future))
+    return future.result()
+
+@contextmanager
+def transaction():
+    current = state()
+    con = getattr(current, 'db_transaction', None)
+    if con is not None:
+        current.db_savepoint_depth += 1
+        savepoint = f'sp{current.db_savepoint_depth}'
+        con.execute(f'SAVEPOINT {savepoint}')
+        try:
+            yield con
+        except BaseException:
+            con.execute(f'ROLLBACK TO {savepoint}')
+            con.execute(f'RELEASE {savepoint}')
+            raise
+        else:
+            con.execute(f'RELEASE {savepoint}')
+        finally:
+            current.db_savepoint_depth -= 1
+        return
+
+    with _write_lock:
+        con = get_connection()
+        try:
+            begin(con)
+        except BaseException:
+            release_connection(con)
+            raise
+        current.db_transaction = con
+        current.db_savepoint_depth = 0
+        try:
+            yield con
+        except BaseException:
+            con.rollback()
+            raise
+        else:
+            con.commit()
+        finally:
+            current.db_transaction = None
+            release_connection(con)
+
+def normalize_sql(sql):
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    return re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', sql)
+
+def parameter_shape(params):
+    if params is None:
+        return 'many'
+    if isinstance(params, dict):
+        return {name: type(value).__name__ for name, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+def get_slow_log():
+    with _slow_lock:
+        if not slow_log.handlers:
+            handler = RotatingFileHandler(config.DB_SLOW_QUERY_LOG,
+                                          maxBytes=config.DB_SLOW_QUERY_LOG_MAX_BYTES,
+                                          backupCount=config.DB_SLOW_QUERY_LOG_BACKUPS,
+                                          encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            slow_log.addHandler(handler)
+            slow_log.setLevel(logging.INFO)
+            slow_log.propagate = False
+    return slow_log
+
+def log_slow_query(con, sql, params, duration):
+    normalized = normalize_sql(sql)
+    fingerprint = hashlib.sha1(normalized.encode()).hexdigest()[:16]
+    entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+             'fingerprint': fingerprint,
+             'duration': round(duration, 6),
+             'route': f'{request.method} {request.url_rule or request.path}' if has_request_context() else None,
+             'params': parameter_shape(params)}
+    with _slow_lock:
+        first = fingerprint not in _slow_seen
+        _slow_seen.add(fingerprint)
+    # The statement text and its plan are written once per fingerprint and
+    # process; later occurrences only add their timing.
+    if first:
+        entry['sql'] = normalized
+        if params is not None:
+            explain_con = con or get_connection(readonly=True)
+            try:
+                entry['plan'] = [row[3] for row in explain_con.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+            except sqlite3.Error as error:
+                entry['plan'] = [f'EXPLAIN failed: {error}']
+            finally:
+                if con is None:
+                    release_connection(explain_con)
+    get_slow_log().info(json.dumps(entry))
+
+def read_slow_queries():
+    paths = sorted(glob.glob(glob.escape(config.DB_SLOW_QUERY_LOG) + '*'), reverse=True)
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+def summarize_slow_queries(top=10):
+    summary = defaultdict(lambda: {'count': 0, 'total': 0, 'max': 0, 'routes': set(), 'sql': None, 'plan': None})
+    for entry in read_slow_queries():
+        item = summary[entry['fingerprint']]
+        item['count'] += 1
+        item['total'] += entry['duration']
+        item['max'] = max(item['max'], entry['duration'])
+        if entry.get('route'):
+            item['routes'].add(entry['route'])
+        item['sql'] = entry.get('sql', item['sql'])
+        item['plan'] = entry.get('plan', item['plan'])
+    ranked = sorted(summary.items(), key=lambda pair: pair[1]['total'], reverse=True)
+    return ranked[:top]
+
+def record_statement(con, sql, params, started):
+    duration = time.perf_counter() - started
+    current = state()
+    current.db_statements = getattr(current, 'db_statements', 0) + 1
+    current.db_statement_time = getattr(current, 'db_statement_time', 0) + duration
+    metrics.observe_statement(duration)
+    if statement_log is not None:
+        statement_log.setdefault(sql, params)
+    if config.DB_SLOW_QUERY_THRESHOLD is not None and duration >= config.DB_SLOW_QUERY_THRESHOLD:
+        log_slow_query(con, sql, params, duration)
+
+def use_write_queue():
+    # Statements outside db.transaction() go to the writer thread, which
+    # commits whatever has queued up meanwhile in one transaction.
+    return config.DB_WRITE_QUEUE and getattr(state(), 'db_transaction', None) is None
+
 def execute(sql, params=()):
-    con = get_connection()
-    with con:
+    if use_write_queue():
+        started = time.perf_counter()
+        lastrowid = submit_write(sql, params)
+        record_statement(None, sql, params, started)
+        return lastrowid
+    with transaction() as con:
+        started = time.perf_counter()
         result = con.execute(sql, params)
-    g.last_insert_id = result.lastrowid
-    con.close()
+        record_statement(con, sql, params, started)
+    return result.lastrowid
 
-def last_insert_id():
-    return g.last_insert_id
+def execute_many(sql, params):
+    if use_write_queue():
+        started = time.perf_counter()
+        submit_write(sql, params, many=True)
+        record_statement(None, sql, None, started)
+        return
+    with transaction() as con:
+        started = time.perf_counter()
+        con.executemany(sql, params)
+        record_statement(con, sql, None, started)
 
-def query(sql, params=()):
+def apply_schema():
     con = get_connection()
+    with open('schema.sql', encoding='utf-8') as f:
+        con.executescript(f.read())
+    release_connection(con)
+
+def query(sql, params=()):
+    con = get_connection(readonly=True)
+    started = time.perf_counter()
     result = con.execute(sql, params).fetchall()
-    con.close()
+    record_statement(con, sql, params, started)
+    release_connection(con)
+    return result
+
+def iterate(sql, params=(), arraysize=None):
+    # Fetches arraysize rows at a time. Outside a transaction it reads through
+    # its own connection, which a streamed response can keep using after the
+    # request's connections are closed.
+    con = getattr(state(), 'db_transaction', None)
+    own_connection = con is None
+    if own_connection:
+        con = connect(readonly=config.DB_READ_ONLY_CONNECTIONS)
+        for name, value in config.DB_ITERATE_PRAGMAS.items():
+            con.execute(f'PRAGMA {name} = {value}')
+    try:
+        started = time.perf_counter()
+        cursor = con.execute(sql, params)
+        cursor.arraysize = arraysize or config.DB_ITERATE_ARRAYSIZE
+        record_statement(con, sql, params, started)  # time to the first rows
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            yield from rows
+    finally:
+        if own_connection:
+            con.close()
+
+def query_in(sql, values, params=()):
+    # {placeholders} in sql becomes one ? per value, DB_IN_BATCH_SIZE values
+    # per query; params are bound before them.
+    values = list(values)
+    result = []
+    for start in range(0, len(values), config.DB_IN_BATCH_SIZE):
+        batch = values[start:start + config.DB_IN_BATCH_SIZE]
+        placeholders = ','.join('?' for _ in batch)
+        result.extend(query(sql.format(placeholders=placeholders), list(params) + batch))
     return result
@@ -0,0 +1,78 @@
+import json
+import zlib
+import config
+import db
+
+# Rows are streamed from db.iterate() and written out as they come, so an
+# export holds at most one fetch batch and one output chunk in memory.
+EXPORTS = {
+    'recipes': '''SELECT r.id,
+                         r.name,
+                         r.content,
+                         r.user_id,
+                         u.username,
+                         r.image_hash,
+                         r.image_type,
+                         r.created,
+                         r.modified,
+                         (SELECT json_group_array(t.name) FROM tags t, recipe_tags rt WHERE rt.recipe_id = r.id AND rt.tag_id = t.id) AS tags
+                  FROM recipes r LEFT JOIN users u ON u.id = r.user_id
+                  ORDER BY r.id''',
+    'reviews': '''SELECT rv.id,
+                         rv.recipe_id,
+                         rv.user_id,
+                         u.username,
+                         rv.rating,
+                         rv.comment,
+                         rv.created,
+                         rv.modified
+                  FROM reviews rv LEFT JOIN users u ON u.id = rv.user_id
+                  ORDER BY rv.id''',
+    'users': '''SELECT id,
+                       username,
+                       created
+                FROM users
+                ORDER BY id''',
+}
+
+def ndjson_lines(table):
+    for row in db.iterate(EXPORTS[table]):
+        record = dict(row)
+        if 'tags' in record:
+            record['tags'] = sorted(json.loads(record['tags']))
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+def chunks(lines, size=None):
+    size = size or config.EXPORT_CHUNK_SIZE
+    buffer = []
+    length = 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+def gzip_chunks(data_chunks, level=None):
+    compressor = zlib.compressobj(config.EXPORT_GZIP_LEVEL if level is None else level,
+                                  zlib.DEFLATED, 31)  # 31: gzip header
+    for data in data_chunks:
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def stream(table, compress=False):
+    data_chunks = chunks(ndjson_lines(table))
+    return gzip_chunks(data_chunks) if compress else data_chunks
+
+def write(table, output, compress=False):
+    written = 0
+    for data in stream(table, compress):
+        output.write(data)
+        written += len(data)
+    return written
@@ -0,0 +1,69 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+import config
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+_executor = None
+
+def image_path(image_hash):
+    return os.path.join(os.path.abspath(config.IMAGE_DIR), image_hash[:2], image_hash[2:4], image_hash)
+
+def store_image(data):
+    image_hash = hashlib.sha256(data).hexdigest()
+    path = image_path(image_hash)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    return image_hash
+
+def delete_image(image_hash):
+    for path in [image_path(image_hash)] + [variant_path(image_hash, size) for size in config.IMAGE_VARIANT_WIDTHS]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def mimetype(image_type):
+    return 'image/jpeg' if image_type == 'jpg' else f'image/{image_type}'
+
+def variant_path(image_hash, size):
+    return f'{image_path(image_hash)}.{size}'
+
+def has_variant(image_hash, size):
+    return os.path.exists(variant_path(image_hash, size))
+
+def generate_variants(path, widths):
+    with Image.open(path) as image:
+        image_format = image.format
+        for size, width in widths.items():
+            target = f'{path}.{size}'
+            if os.path.exists(target):
+                continue
+            variant = image.copy()
+            if variant.width > width:
+                height = max(1, round(variant.height * width / variant.width))
+                variant = variant.resize((width, height), Image.Resampling.LANCZOS)
+            if image_format == 'JPEG' and variant.mode not in ('RGB', 'L'):
+                variant = variant.convert('RGB')
+            temp_path = f'{target}.{os.getpid()}.tmp'
+            variant.save(temp_path, format=image_format)
+            os.replace(temp_path, target)
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=config.IMAGE_WORKERS)
+    return _executor
+
+def generate_variants_in_background(image_hash):
+    if Image is None:
+        return None
+    return get_executor().submit(generate_variants, image_path(image_hash), config.IMAGE_VARIANT_WIDTHS)
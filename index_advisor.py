@@ -0,0 +1,175 @@
+import contextlib
+import io
+import re
+import sqlite3
+import config
+import db
+
+# Read routes crawled to collect the statements the app issues; {recipe_id}
+# and {username} are filled from the database.
+CRAWL_PATHS = [
+    '/',
+    '/{last_page}',
+    '/recipe/{recipe_id}',
+    '/recipe/{recipe_id}/2',
+    '/search?query=recipe',
+    '/search?query=recipe&order=rank',
+    '/search?query=&tags={tag}',
+    '/search?query=recipe&tags={tag}&tags={other_tag}&match=all',
+    '/user/{username}',
+    '/user/{username}/2',
+    '/image/{recipe_id}',
+]
+
+def get_indexes():
+    indexes = {}
+    tables = [row[0] for row in db.query("SELECT name FROM sqlite_master WHERE type = 'table' AND sql NOT LIKE 'CREATE VIRTUAL%'")]
+    for table in tables:
+        for index in db.query(f"PRAGMA index_list('{table}')"):
+            if index['partial']:
+                continue
+            columns = tuple(row['name'] for row in db.query(f"PRAGMA index_info('{index['name']}')"))
+            indexes[index['name']] = {'table': table, 'unique': bool(index['unique']),
+                                      'origin': index['origin'], 'columns': columns}
+    return indexes
+
+def find_redundant(indexes):
+    # A non-unique index whose columns are a prefix of another index's
+    # columns can always be replaced by that index.
+    redundant = []
+    for name, index in sorted(indexes.items()):
+        if index['unique']:
+            continue
+        for other_name, other in sorted(indexes.items()):
+            if other_name == name or other['table'] != index['table']:
+                continue
+            prefix = other['columns'][:len(index['columns'])] == index['columns']
+            same = other['columns'] == index['columns']
+            if prefix and (not same or other['unique'] or other_name < name):
+                redundant.append((name, other_name))
+                break
+    return redundant
+
+def collect_statements(app):
+    recipe = db.query('SELECT id, user_id FROM recipes ORDER BY id LIMIT 1')
+    tags = db.query('SELECT name FROM tags ORDER BY id LIMIT 2')
+    user = db.query('SELECT username FROM users WHERE id = ?', (recipe[0]['user_id'],)) if recipe else []
+    values = {'recipe_id': recipe[0]['id'] if recipe else 1,
+              'username': user[0]['username'] if user else 'nobody',
+              'tag': tags[0]['name'] if tags else 'none',
+              'other_tag': tags[-1]['name'] if tags else 'none',
+              'last_page': max(1, (db.query('SELECT COUNT(*) FROM recipes')[0][0] + 9) // 10)}
+    statements = {}
+    previous, db.statement_log = db.statement_log, statements
+    cache_enabled, config.PAGE_CACHE_ENABLED = config.PAGE_CACHE_ENABLED, False
+    try:
+        client = app.test_client()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for path in CRAWL_PATHS:
+                client.get(path.format(**values))
+    finally:
+        db.statement_log = previous
+        config.PAGE_CACHE_ENABLED = cache_enabled
+    for entry in db.read_slow_queries():
+        if entry.get('sql'):
+            # normalized text: bind NULL to every placeholder
+            statements.setdefault(entry['sql'], [None] * entry['sql'].count('?'))
+    return statements
+
+def explain(statements):
+    plans = {}
+    for sql, params in statements.items():
+        if not re.match(r'\s*(SELECT|WITH|UPDATE|DELETE|INSERT)', sql, re.IGNORECASE):
+            continue
+        try:
+            plans[sql] = [row['detail'] for row in db.query('EXPLAIN QUERY PLAN ' + sql, params or ())]
+        except sqlite3.Error:
+            continue
+    return plans
+
+def aliases(sql, tables):
+    found = {}
+    pattern = r'\b(' + '|'.join(map(re.escape, tables)) + r')\b(?:\s+(?:AS\s+)?(?!WHERE|ON|ORDER|GROUP|LIMIT|JOIN|USING|SET|VALUES)(\w+))?'
+    for table, alias in re.findall(pattern, sql, re.IGNORECASE):
+        found[alias or table] = table
+    return found
+
+def referenced_columns(sql, alias, table, columns, single_table):
+    if single_table:
+        return {column for column in columns if re.search(rf'\b{column}\b', sql)}
+    return {column for column in re.findall(rf'\b{re.escape(alias)}\.(\w+)', sql) if column in columns}
+
+def equality_columns(sql, alias, single_table):
+    prefix = '' if single_table else re.escape(alias) + r'\.'
+    return re.findall(rf'(?<![\w.]){prefix}(\w+)\s*(?:=|IN)\s*[(?]', sql)
+
+def order_columns(sql, alias, single_table):
+    match = re.search(r'ORDER BY (.*?)(?:LIMIT|$)', sql, re.IGNORECASE | re.DOTALL)
+    if not match:
+        return []
+    prefix = '' if single_table else re.escape(alias) + r'\.'
+    return re.findall(rf'(?<![\w.]){prefix}(\w+)', match.group(1))
+
+def wanted_columns(sql, alias, single_table, columns):
+    # equality columns first, then the sort columns; id is the rowid
+    wanted = equality_columns(sql, alias, single_table) + order_columns(sql, alias, single_table)
+    return tuple(dict.fromkeys(c for c in wanted if c in columns and c != 'id'))
+
+def suggest(sql, details, tables, indexes):
+    suggestions = []
+    found = aliases(sql, tables)
+    single_table = len(set(found.values())) == 1
+    for detail in details:
+        match = re.match(r'(SCAN|SEARCH) (\w+)(?: USING (COVERING )?INDEX (\w+)(?: \((.*)\))?)?', detail)
+        if not match or match.group(2) not in found:
+            continue
+        kind, alias, covering, index, _ = match.groups()
+        table = found[alias]
+        columns = tables[table]
+        if kind == 'SCAN' and not index:
+            wanted = wanted_columns(sql, alias, single_table, columns)
+            if wanted:
+                suggestions.append((table, wanted, f'full scan of {table}'))
+        elif kind == 'SEARCH' and index and not covering:
+            used = set(referenced_columns(sql, alias, table, columns, single_table)) - {'id'}
+            indexed = re.findall(r'(\w+)[=<>]', match.group(5) or '')
+            if index in indexes and indexes[index]['unique'] and set(indexed) >= set(indexes[index]['columns']):
+                continue  # a single row
+            extra = sorted(used - set(indexed))
+            if extra and len(extra) <= 2:
+                suggestions.append((table, tuple(indexed) + tuple(extra),
+                                    f'{index} needs table lookups for {", ".join(extra)}'))
+    if any('USE TEMP B-TREE FOR ORDER BY' in detail for detail in details) and single_table:
+        table = next(iter(found.values()))
+        wanted = wanted_columns(sql, table, True, tables[table])
+        if wanted:
+            suggestions.append((table, wanted, 'sorts in a temporary b-tree'))
+    return suggestions
+
+def advise(app):
+    indexes = get_indexes()
+    statements = collect_statements(app)
+    plans = explain(statements)
+    used = set()
+    for details in plans.values():
+        for detail in details:
+            match = re.search(r'USING (?:COVERING )?INDEX (\w+)', detail)
+            if match:
+                used.add(match.group(1))
+    tables = {}
+    for name in {index['table'] for index in indexes.values()} | {'recipes', 'reviews', 'users', 'tags', 'recipe_tags'}:
+        tables[name] = {row['name'] for row in db.query(f"PRAGMA table_info('{name}')")}
+    existing = {(index['table'], index['columns'][:n]) for index in indexes.values()
+                for n in range(1, len(index['columns']) + 1)}
+    missing = {}
+    for sql, details in plans.items():
+        for table, columns, reason in suggest(sql, details, tables, indexes):
+            if (table, columns) not in existing:
+                missing.setdefault((table, columns), (reason, sql))
+    return {
+        'statements': len(plans),
+        'redundant': find_redundant(indexes),
+        'unused': sorted(name for name, index in indexes.items()
+                         if name not in used and index['origin'] == 'c'),
+        'missing': missing,
+    }
@@ -0,0 +1,85 @@
+import bisect
+import threading
+from collections import defaultdict
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+STATEMENT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_lock = threading.Lock()
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels=''):
+        prefix = labels + ',' if labels else ''
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield f'{name}_bucket{{{prefix}le="{bound}"}} {total}'
+        yield f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}'
+        suffix = '{' + labels + '}' if labels else ''
+        yield f'{name}_sum{suffix} {self.sum}'
+        yield f'{name}_count{suffix} {self.count}'
+
+_request_seconds = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+_request_queries = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+_statement_seconds = Histogram(STATEMENT_BUCKETS)
+_requests = defaultdict(int)
+_over_budget = defaultdict(int)
+
+def observe_statement(duration):
+    with _lock:
+        _statement_seconds.observe(duration)
+
+def observe_request(endpoint, method, status, duration, statements, over_budget):
+    with _lock:
+        _request_seconds[endpoint].observe(duration)
+        _request_queries[endpoint].observe(statements)
+        _requests[endpoint, method, status] += 1
+        if over_budget:
+            _over_budget[endpoint] += 1
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def header(name, kind, text):
+    return [f'# HELP {name} {text}', f'# TYPE {name} {kind}']
+
+def render(cache):
+    lines = []
+    with _lock:
+        lines += header('app_requests_total', 'counter', 'Requests by endpoint, method and status.')
+        for (endpoint, method, status), count in sorted(_requests.items()):
+            lines.append(f'app_requests_total{{endpoint="{label(endpoint)}",method="{method}",status="{status}"}} '
+                         f'{count}')
+        lines += header('app_request_duration_seconds', 'histogram', 'Request latency by endpoint.')
+        for endpoint, histogram in sorted(_request_seconds.items()):
+            lines += histogram.lines('app_request_duration_seconds', f'endpoint="{label(endpoint)}"')
+        lines += header('app_request_statements', 'histogram', 'SQL statements run per request by endpoint.')
+        for endpoint, histogram in sorted(_request_queries.items()):
+            lines += histogram.lines('app_request_statements', f'endpoint="{label(endpoint)}"')
+        lines += header('app_request_statement_budget_exceeded_total', 'counter',
+                        'Requests that ran more statements than DB_STATEMENT_BUDGET.')
+        for endpoint, count in sorted(_over_budget.items()):
+            lines.append(f'app_request_statement_budget_exceeded_total{{endpoint="{label(endpoint)}"}} {count}')
+        lines += header('app_db_statement_duration_seconds', 'histogram', 'Duration of single SQL statements.')
+        lines += _statement_seconds.lines('app_db_statement_duration_seconds')
+    lines += header('app_page_cache_hits_total', 'counter', 'Pages served from the page cache.')
+    lines.append(f'app_page_cache_hits_total {cache["hits"]}')
+    lines += header('app_page_cache_misses_total', 'counter', 'Page cache lookups that rendered the page.')
+    lines.append(f'app_page_cache_misses_total {cache["misses"]}')
+    lines += header('app_page_cache_entries', 'gauge', 'Pages in the page cache.')
+    lines.append(f'app_page_cache_entries {cache["entries"]}')
+    lines += header('app_page_cache_size', 'gauge', 'Characters of HTML in the page cache.')
+    lines.append(f'app_page_cache_size {cache["size"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,91 @@
+import counters_db
+import db
+import recipes_db
+import reviews_db
+
+# Databases made from schema.sql before this runner existed have
+# user_version 0. New databases get schema.sql as it is now and start at the
+# latest version. Migrations must also work on a database that already has
+# some of their changes, as earlier releases updated it piecemeal.
+
+def upgrade_legacy_schema():
+    db.apply_schema()
+    recipes_db.migrate_images()
+    reviews_db.rebuild_recipe_stats()
+    counters_db.check_counters(repair=True)
+    recipes_db.build_search_index()
+
+def drop_duplicate_indexes():
+    # Each of these has the same leading columns as a UNIQUE constraint's
+    # index or a composite index, so it only costs writes.
+    with db.transaction():
+        for name in ('idx_tag_name',                 # UNIQUE(name)
+                     'idx_tags_name',                # UNIQUE(name)
+                     'idx_users_username',           # UNIQUE(username)
+                     'idx_recipe_tags_recipe_tag',   # UNIQUE(recipe_id, tag_id)
+                     'idx_recipe_tags_recipe_id',    # UNIQUE(recipe_id, tag_id)
+                     'idx_reviews_recipe_user',      # UNIQUE(recipe_id, user_id)
+                     'idx_reviews_recipe_id',        # UNIQUE(recipe_id, user_id)
+                     'idx_recipes_user_id'):         # idx_recipes_user_name
+            db.execute(f'DROP INDEX IF EXISTS {name}')
+
+def add_tag_index_changes():
+    # table and triggers from schema.sql; the index loads everything on
+    # its first search
+    db.apply_schema()
+
+def add_user_generation():
+    db.apply_schema()
+
+def add_recipe_imports():
+    db.execute('DROP TRIGGER IF EXISTS tag_index_changes_prune')  # recreated to prune in bulk
+    db.apply_schema()
+
+MIGRATIONS = [
+    (1, 'bring a database made from an earlier schema.sql up to date', upgrade_legacy_schema),
+    (2, 'drop indexes that duplicate UNIQUE constraints or other indexes', drop_duplicate_indexes),
+    (3, 'log recipe and tag changes for the in-memory tag index', add_tag_index_changes),
+    (4, 'count username changes for the typeahead index', add_user_generation),
+    (5, 'record the progress of bulk recipe imports and prune the tag index log in bulk', add_recipe_imports),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_version():
+    con = db.get_connection()
+    version = con.execute('PRAGMA user_version').fetchone()[0]
+    db.release_connection(con)
+    return version
+
+def set_version(version):
+    db.execute(f'PRAGMA user_version = {int(version)}')
+
+def is_empty():
+    con = db.get_connection()
+    table = con.execute("SELECT name FROM sqlite_master WHERE type = 'table' LIMIT 1").fetchone()
+    db.release_connection(con)
+    return table is None
+
+def create_schema():
+    # schema.sql spells out the default tokenizer; a fresh database gets the
+    # search index with the configured one instead.
+    db.apply_schema()
+    recipes_db.build_search_index()
+
+def get_pending():
+    version = get_version()
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+def migrate(progress=print):
+    if is_empty():
+        create_schema()
+        set_version(LATEST_VERSION)
+        progress(f'Created the schema at version {LATEST_VERSION}.')
+        return
+    pending = get_pending()
+    for version, description, function in pending:
+        progress(f'Applying migration {version}: {description}')
+        function()
+        set_version(version)
+    if pending:
+        db.execute('ANALYZE')
+    progress(f'Database is at schema version {get_version()}.')
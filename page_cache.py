@@ -0,0 +1,89 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from flask import make_response, request, session
+import config
+import counters_db
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_size = 0
+hits = 0
+misses = 0
+
+def get(key):
+    global hits, misses
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            misses += 1
+            return None
+        _entries.move_to_end(key)
+        hits += 1
+        return entry[1]
+
+def put(key, value):
+    global _size
+    with _lock:
+        if key in _entries:
+            _size -= len(_entries.pop(key)[1])
+        _entries[key] = (time.monotonic() + config.PAGE_CACHE_TTL, value)
+        _size += len(value)
+        while _size > config.PAGE_CACHE_MAX_SIZE and _entries:
+            _, (_, evicted) = _entries.popitem(last=False)
+            _size -= len(evicted)
+
+def clear():
+    global _size
+    with _lock:
+        _entries.clear()
+        _size = 0
+
+def stats():
+    with _lock:
+        return {'hits': hits, 'misses': misses, 'entries': len(_entries), 'size': _size}
+
+def make_etag(stamps, user_id):
+    data = repr((config.DATABASE, request.full_path, stamps, user_id)).encode()
+    return hashlib.sha1(data).hexdigest()
+
+def cached_page(versions, mimetype=None):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            user_id = session.get('user_id')
+            flashes = session.get('_flashes')
+            stamps = counters_db.get_counters(versions(**kwargs))
+            etag = make_etag(stamps, user_id)
+            if not flashes and request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                use_cache = config.PAGE_CACHE_ENABLED and not user_id and not flashes
+                key = (config.DATABASE, request.full_path, stamps)
+                html = get(key) if use_cache else None
+                if html is None:
+                    result = view(**kwargs)
+                    if not isinstance(result, str):
+                        return result
+                    if use_cache:
+                        put(key, result)
+                    response = make_response(result)
+                    if mimetype:
+                        response.mimetype = mimetype
+                    if use_cache:
+                        response.headers['X-Cache'] = 'MISS'
+                else:
+                    response = make_response(html)
+                    if mimetype:
+                        response.mimetype = mimetype
+                    response.headers['X-Cache'] = 'HIT'
+            if not flashes:
+                response.set_etag(etag)
+            # Revalidate every time; pages with a session are per user.
+            response.headers['Cache-Control'] = 'private, no-cache' if user_id else 'public, no-cache'
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
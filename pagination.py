@@ -0,0 +1,29 @@
+import base64
+import binascii
+import json
+
+def encode_cursor(key, page):
+    data = json.dumps([list(key), page], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        key, page = json.loads(data)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    # The key is bound straight into the seek query as (sort value, id).
+    if (not isinstance(key, list) or len(key) != 2 or
+            not all(isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in key) or
+            not isinstance(page, int) or isinstance(page, bool)):
+        return None
+    return tuple(key), page
+
+def cursors(items, page, page_count, key):
+    if not items:
+        return None, None
+    prev_cursor = encode_cursor(key(items[0]), page - 1) if page > 1 else None
+    next_cursor = encode_cursor(key(items[-1]), page + 1) if page < page_count else None
+    return prev_cursor, next_cursor
@@ -0,0 +1,177 @@
+import base64
+import binascii
+import hashlib
+import json
+import os
+import time
+import config
+import db
+import images
+import validation
+
+# Bulk import of recipes from NDJSON, one recipe per line:
+#
+#   {"name": "...", "content": "...", "tags": ["soup", "vegan"],
+#    "image": "<base64>", "image_type": "png"}
+#
+# "tags" may also be a string as in the form, and "image_path" (relative to
+# the image directory, command line only) can be given instead of "image".
+# Every IMPORT_BATCH_SIZE input lines are written in one transaction together
+# with the import's progress in recipe_imports, so a run that is stopped can
+# be started again with the same key and continues after the last batch.
+
+def make_key(data_chunks, user_id):
+    digest = hashlib.sha256(str(user_id).encode() + b'\0')
+    for data in data_chunks:
+        digest.update(data)
+    return digest.hexdigest()
+
+def file_key(path, user_id):
+    with open(path, 'rb') as f:
+        return make_key(iter(lambda: f.read(1024 * 1024), b''), user_id)
+
+def parse_record(line, image_dir=None):
+    # Raises ValueError with the reasons the line was rejected.
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise ValueError('Not valid JSON.') from None
+    if not isinstance(record, dict):
+        raise ValueError('The line is not a JSON object.')
+    name = record.get('name') or ''
+    content = record.get('content') or ''
+    tags = record.get('tags') or []
+    if not isinstance(name, str) or not isinstance(content, str):
+        raise ValueError('Recipe name and content must be strings.')
+    if isinstance(tags, list) and all(isinstance(tag, str) for tag in tags):
+        tags = ' '.join(tags)
+    if not isinstance(tags, str):
+        raise ValueError('Tags must be a string or a list of strings.')
+    errors = validation.recipe_errors(name, content)
+
+    image = filename = None
+    if record.get('image') is not None:
+        filename = f'image.{record.get("image_type")}'
+        try:
+            image = base64.b64decode(record['image'], validate=True)
+        except (binascii.Error, TypeError, ValueError):
+            errors.append('Image is not valid base64.')
+    elif record.get('image_path') is not None:
+        if image_dir is None:
+            errors.append('Image paths can only be imported from the command line.')
+        else:
+            # Absolute paths and '..' must not reach files outside image_dir.
+            root = os.path.realpath(image_dir)
+            filename = os.path.realpath(os.path.join(root, str(record['image_path'])))
+            type_errors = validation.image_type_errors(filename)
+            if os.path.commonpath([root, filename]) != root:
+                errors.append(f'Image file {record["image_path"]} is outside the image directory.')
+            elif type_errors:
+                errors += type_errors
+            else:
+                try:
+                    with open(filename, 'rb') as f:
+                        image = f.read(config.MAX_IMAGE_SIZE + 1)
+                except OSError:
+                    errors.append(f'Image file {record["image_path"]} cannot be read.')
+    if image is not None:
+        errors += validation.image_errors(filename, image)
+    if errors:
+        raise ValueError(' '.join(errors))
+    return {
+        'name': name,
+        'content': content,
+        'tags': list(dict.fromkeys(validation.parse_tags(tags))),
+        'image': image,
+        'image_type': validation.image_type(filename) if image is not None else None,
+    }
+
+def get_progress(key):
+    result = db.query('''SELECT lines,
+                                recipes,
+                                errors,
+                                finished
+                         FROM recipe_imports
+                         WHERE key = ?''', (key,))
+    if not result:
+        return {'lines': 0, 'recipes': 0, 'errors': 0, 'finished': False}
+    return {**dict(result[0]), 'finished': bool(result[0]['finished'])}
+
+def resolve_tags(names):
+    # Called inside the batch's transaction: a tag that a concurrent edit
+    # removed since the last batch is created again rather than referenced
+    # by a stale id.
+    names = sorted(set(names))
+    db.execute_many('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(name,) for name in names])
+    return {row['name']: row['id'] for row in
+            db.query_in('SELECT id, name FROM tags WHERE name IN ({placeholders})', names)}
+
+def write_batch(key, user_id, recipes, progress):
+    with db.transaction():
+        tag_ids = resolve_tags(tag for recipe in recipes for tag in recipe['tags'])
+        # The write lock is held, so the ids after the current maximum are
+        # the ones SQLite would give the rows.
+        first_id = db.query('SELECT IFNULL(MAX(id), 0) + 1 AS id FROM recipes')[0]['id']
+        db.execute_many('''INSERT INTO recipes (id, name, content, image_hash, image_type, user_id)
+                           VALUES (?, ?, ?, ?, ?, ?)''',
+                        [(first_id + i, recipe['name'], recipe['content'], recipe['image_hash'],
+                          recipe['image_type'], user_id) for i, recipe in enumerate(recipes)])
+        db.execute_many('INSERT INTO recipe_tags (recipe_id, tag_id) VALUES (?, ?)',
+                        [(first_id + i, tag_ids[tag]) for i, recipe in enumerate(recipes) for tag in recipe['tags']])
+        db.execute('''INSERT INTO recipe_imports (key, user_id, lines, recipes, errors, finished)
+                      VALUES (?, ?, ?, ?, ?, ?)
+                      ON CONFLICT(key) DO UPDATE SET lines = excluded.lines,
+                                                     recipes = excluded.recipes,
+                                                     errors = excluded.errors,
+                                                     finished = excluded.finished,
+                                                     modified = CURRENT_TIMESTAMP''',
+                   (key, user_id, progress['lines'], progress['recipes'], progress['errors'],
+                    int(progress['finished'])))
+
+def import_lines(lines, user_id, key, image_dir=None, batch_size=None, report=None):
+    # Skips the lines that an earlier run with the same key committed. Returns
+    # the progress and the (line number, message) of lines rejected this run.
+    batch_size = batch_size or config.IMPORT_BATCH_SIZE
+    progress = get_progress(key)
+    rejected = []
+    if progress['finished']:
+        return progress, rejected
+    started = time.perf_counter()
+    recipes = []
+    stored_images = []
+    committed = progress['lines']
+    line_number = 0
+
+    def commit(finished=False):
+        nonlocal recipes, stored_images
+        changed = line_number != progress['lines']
+        progress.update(lines=line_number, finished=finished)
+        progress['recipes'] += len(recipes)
+        write_batch(key, user_id, recipes, progress)
+        for image_hash in stored_images:
+            images.generate_variants_in_background(image_hash)
+        recipes, stored_images = [], []
+        if report and changed:
+            report({**progress, 'elapsed': time.perf_counter() - started})
+
+    for line_number, line in enumerate(lines, 1):
+        if line_number <= committed:
+            continue
+        if line.strip():
+            try:
+                recipe = parse_record(line, image_dir)
+            except ValueError as error:
+                rejected.append((line_number, str(error)))
+                progress['errors'] += 1
+            else:
+                # Images go to disk right away; only their hashes are kept.
+                image = recipe.pop('image')
+                recipe['image_hash'] = images.store_image(image) if image is not None else None
+                if recipe['image_hash']:
+                    stored_images.append(recipe['image_hash'])
+                recipes.append(recipe)
+        if line_number - progress['lines'] >= batch_size:
+            commit()
+    line_number = max(line_number, progress['lines'])
+    commit(finished=True)
+    return progress, rejected
@@ -1,20 +1,20 @@
+import re
+import config
+import counters_db
 import db
+import images
 
-def add_recipe(user_id, name, content=None, image=None, image_type=None):
+def add_recipe(user_id, name, content=None, image_hash=None, image_type=None):
     sql = '''INSERT INTO recipes (name,
                                   content,
-                                  image,
+                                  image_hash,
                                   image_type,
                                   user_id)
              VALUES (?, ?, ?, ?, ?)'''
-    db.execute(sql, (name, content, image, image_type, user_id))
-    return db.last_insert_id()
+    return db.execute(sql, (name, content, image_hash, image_type, user_id))
 
 def get_recipe_count():
-    sql = '''SELECT COUNT(*) AS count
-             FROM recipes'''
-    result = db.query(sql)
-    return result[0]['count'] if result else 0
+    return counters_db.get_counter('recipes')
 
 def get_all_recipes():
     sql = '''SELECT r.id,
@@ -36,26 +36,51 @@ def get_recipes(page, page_size):
                     r.modified,
                     r.user_id,
                     u.username,
-                    (SELECT AVG(rv.rating) FROM reviews rv WHERE rv.recipe_id = r.id) AS average_rating,
-                    (SELECT COUNT(rv.id) FROM reviews rv WHERE rv.recipe_id = r.id) AS review_count,
+                    (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                    IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count,
                     (SELECT GROUP_CONCAT(t.name, ', ') FROM tags t, recipe_tags rt WHERE rt.recipe_id = r.id AND rt.tag_id = t.id) AS tags
              FROM recipes r, users u
              WHERE r.user_id = u.id
-             ORDER BY r.name ASC
+             ORDER BY r.name ASC, r.id ASC
              LIMIT ? OFFSET ?'''
     return db.query(sql, (page_size, offset))
 
+def get_recipes_seek(page_size, after=None, before=None):
+    if before:
+        seek, order, params = '(r.name, r.id) < (?, ?)', 'DESC', list(before)
+    elif after:
+        seek, order, params = '(r.name, r.id) > (?, ?)', 'ASC', list(after)
+    else:
+        seek, order, params = '1', 'ASC', []
+    sql = f'''SELECT r.id,
+                     r.name,
+                     r.created,
+                     r.modified,
+                     r.user_id,
+                     u.username,
+                     (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                     IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count,
+                     (SELECT GROUP_CONCAT(t.name, ', ') FROM tags t, recipe_tags rt WHERE rt.recipe_id = r.id AND rt.tag_id = t.id) AS tags
+              FROM recipes r, users u
+              WHERE r.user_id = u.id AND
+                    {seek}
+              ORDER BY r.name {order}, r.id {order}
+              LIMIT ?'''
+    recipes = db.query(sql, params + [page_size])
+    return recipes[::-1] if before else recipes
+
 def get_recipe_by_id(recipe_id):
     sql = '''SELECT r.id,
                     r.name,
                     r.content,
-                    r.image IS NOT NULL AS has_image,
+                    r.image_hash IS NOT NULL AS has_image,
+                    r.image_hash,
                     r.created,
                     r.modified,
                     r.user_id,
                     u.username,
-                    (SELECT AVG(rv.rating) FROM reviews rv WHERE rv.recipe_id = r.id) AS average_rating,
-                    (SELECT COUNT(rv.id) FROM reviews rv WHERE rv.recipe_id = r.id) AS review_count,
+                    (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                    IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count,
                     (SELECT GROUP_CONCAT(t.name, ', ') FROM tags t, recipe_tags rt WHERE rt.recipe_id = r.id AND rt.tag_id = t.id) AS tags
              FROM recipes r, users u
              WHERE r.user_id = u.id AND
@@ -63,67 +88,170 @@ def get_recipe_by_id(recipe_id):
     recipe = db.query(sql, (recipe_id,))
     return recipe[0] if recipe else None
 
+# Fields of the JSON API that are columns of recipes r or recipe_stats s
+RECIPE_FIELDS = {
+    'id': 'r.id',
+    'name': 'r.name',
+    'content': 'r.content',
+    'user_id': 'r.user_id',
+    'created': 'r.created',
+    'modified': 'r.modified',
+    'image_hash': 'r.image_hash',
+    'avg_rating': 's.average_rating',
+    'review_count': 'IFNULL(s.review_count, 0)',
+}
+
+def get_recipe_fields(recipe_ids, fields):
+    columns = ['r.id'] + [f'{RECIPE_FIELDS[field]} AS {field}' for field in fields if field != 'id']
+    stats = ' LEFT JOIN recipe_stats s ON s.recipe_id = r.id' if {'avg_rating', 'review_count'} & set(fields) else ''
+    sql = f'''SELECT {', '.join(columns)}
+              FROM recipes r{stats}
+              WHERE r.id IN ({{placeholders}})'''
+    return db.query_in(sql, recipe_ids)
+
 def get_recipe_image(recipe_id):
-    sql = '''SELECT image,
+    sql = '''SELECT image_hash,
                     image_type
              FROM recipes
              WHERE id = ?'''
     result = db.query(sql, (recipe_id,))
     return result[0] if result else None
 
-def update_recipe(recipe_id, name, content=None, image=None, image_type=None):
+def update_recipe(recipe_id, name, content=None, image_hash=None, image_type=None):
     sql = '''UPDATE recipes
              SET name = ?,
                  content = ?,
-                 image = ?,
+                 image_hash = ?,
                  image_type = ?
              WHERE id = ?'''
-    db.execute(sql, [name, content, image, image_type, recipe_id])
+    db.execute(sql, [name, content, image_hash, image_type, recipe_id])
+
+def is_image_used(image_hash):
+    sql = '''SELECT 1
+             FROM recipes
+             WHERE image_hash = ?
+             LIMIT 1'''
+    return bool(db.query(sql, (image_hash,)))
+
+def get_image_hashes():
+    sql = '''SELECT DISTINCT image_hash
+             FROM recipes
+             WHERE image_hash IS NOT NULL'''
+    return [row['image_hash'] for row in db.query(sql)]
+
+def delete_image_if_unused(image_hash):
+    if image_hash and not is_image_used(image_hash):
+        images.delete_image(image_hash)
+
+def migrate_images(batch_size=100, progress=None):
+    columns = [column['name'] for column in db.query('PRAGMA table_info(recipes)')]
+    if 'image_hash' not in columns:
+        db.execute('ALTER TABLE recipes ADD COLUMN image_hash TEXT')
+    if 'image' not in columns:
+        return 0
+    # The blobs move without touching the recipes' modified timestamps;
+    # db.apply_schema() recreates the trigger afterwards.
+    db.execute('DROP TRIGGER IF EXISTS update_modified')
+    migrated = 0
+    while True:
+        sql = '''SELECT id,
+                        image
+                 FROM recipes
+                 WHERE image IS NOT NULL
+                 LIMIT ?'''
+        batch = db.query(sql, (batch_size,))
+        if not batch:
+            break
+        updates = [(images.store_image(bytes(row['image'])), row['id']) for row in batch]
+        db.execute_many('''UPDATE recipes
+                           SET image_hash = ?,
+                               image = NULL
+                           WHERE id = ?''', updates)
+        migrated += len(updates)
+        if progress:
+            progress(migrated)
+    db.execute('ALTER TABLE recipes DROP COLUMN image')
+    db.apply_schema()
+    return migrated
 
 def delete_recipe(recipe_id):
     sql = '''DELETE FROM recipes
              WHERE id = ?'''
     db.execute(sql, [recipe_id])
 
-def search_recipes(query):
-    sql = '''SELECT r.id,
-                    r.name,
-                    r.created,
-                    r.modified,
-                    r.user_id,
-                    u.username,
-                    (SELECT AVG(rv.rating) FROM reviews rv WHERE rv.recipe_id = r.id) AS average_rating,
-                    (SELECT COUNT(rv.id) FROM reviews rv WHERE rv.recipe_id = r.id) AS review_count,
-                    (SELECT GROUP_CONCAT(t.name, ', ') FROM tags t, recipe_tags rt WHERE rt.recipe_id = r.id AND rt.tag_id = t.id) AS tags
-             FROM recipes r, users u
-             WHERE r.user_id = u.id AND
-                   (r.name LIKE ? OR r.content LIKE ?)
-             ORDER BY r.name ASC'''
-    results = db.query(sql, ['%' + query + '%', '%' + query + '%'])
+def search_match_expression(query):
+    if config.SEARCH_TOKENIZER.startswith('trigram'):
+        if len(query) < 3:
+            return None  # trigram index needs at least three characters
+        return '"' + query.replace('"', '""') + '"'
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search_clauses(query, order='name'):
+    if not query or not query.strip():
+        return '', '1', [], 'r.name ASC'
+    expression = search_match_expression(query)
+    if expression is None:
+        return '', '(r.name LIKE ? OR r.content LIKE ?)', ['%' + query + '%', '%' + query + '%'], 'r.name ASC'
+    if order == 'rank':
+        return ', recipes_fts f', 'f.rowid = r.id AND f.recipes_fts MATCH ?', [expression], 'f.rank, r.name ASC'
+    return '', 'r.id IN (SELECT rowid FROM recipes_fts WHERE recipes_fts MATCH ?)', [expression], 'r.name ASC'
+
+def search_recipes(query, order='name'):
+    tables, where, params, order_by = search_clauses(query, order)
+    sql = f'''SELECT r.id,
+                     r.name,
+                     r.created,
+                     r.modified,
+                     r.user_id,
+                     u.username,
+                     (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                     IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count,
+                     (SELECT GROUP_CONCAT(t.name, ', ') FROM tags t, recipe_tags rt WHERE rt.recipe_id = r.id AND rt.tag_id = t.id) AS tags
+              FROM recipes r, users u{tables}
+              WHERE r.user_id = u.id AND
+                    {where}
+              ORDER BY {order_by}'''
+    results = db.query(sql, params)
     return results if results else None
 
-def search_recipes_paginated(query, page, page_size):
+def search_recipes_paginated(query, page, page_size, order='name'):
     offset = (page - 1) * page_size
-    sql = '''SELECT r.id,
-                    r.name,
-                    r.created,
-                    r.modified,
-                    r.user_id,
-                    u.username,
-                    (SELECT AVG(rv.rating) FROM reviews rv WHERE rv.recipe_id = r.id) AS average_rating,
-                    (SELECT COUNT(rv.id) FROM reviews rv WHERE rv.recipe_id = r.id) AS review_count,
-                    (SELECT GROUP_CONCAT(t.name, ', ') FROM tags t, recipe_tags rt WHERE rt.recipe_id = r.id AND rt.tag_id = t.id) AS tags
-             FROM recipes r, users u
-             WHERE r.user_id = u.id AND
-                   (r.name LIKE ? OR r.content LIKE ?)
-             ORDER BY r.name ASC
-             LIMIT ? OFFSET ?'''
-    results = db.query(sql, ['%' + query + '%', '%' + query + '%', page_size, offset])
+    tables, where, params, order_by = search_clauses(query, order)
+    sql = f'''SELECT r.id,
+                     r.name,
+                     r.created,
+                     r.modified,
+                     r.user_id,
+                     u.username,
+                     (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                     IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count,
+                     (SELECT GROUP_CONCAT(t.name, ', ') FROM tags t, recipe_tags rt WHERE rt.recipe_id = r.id AND rt.tag_id = t.id) AS tags
+              FROM recipes r, users u{tables}
+              WHERE r.user_id = u.id AND
+                    {where}
+              ORDER BY {order_by}
+              LIMIT ? OFFSET ?'''
+    results = db.query(sql, params + [page_size, offset])
     return results if results else None
 
 def get_search_recipe_count(query):
-    sql = '''SELECT COUNT(*) AS count
-             FROM recipes r
-             WHERE (r.name LIKE ? OR r.content LIKE ?)'''
-    result = db.query(sql, ['%' + query + '%', '%' + query + '%'])
+    tables, where, params, _ = search_clauses(query)
+    sql = f'''SELECT COUNT(*) AS count
+              FROM recipes r{tables}
+              WHERE {where}'''
+    result = db.query(sql, params)
     return result[0]['count'] if result else 0
+
+def build_search_index(tokenizer=None):
+    tokenizer = tokenizer or config.SEARCH_TOKENIZER
+    with db.transaction():
+        db.execute('DROP TABLE IF EXISTS recipes_fts')
+        db.execute(f'''CREATE VIRTUAL TABLE recipes_fts USING fts5(name,
+                                                                content,
+                                                                content='recipes',
+                                                                content_rowid='id',
+                                                                tokenize='{tokenizer}')''')
+        db.execute("INSERT INTO recipes_fts (recipes_fts) VALUES ('rebuild')")
@@ -20,23 +20,47 @@ def get_reviews_for_recipe_paginated(recipe_id, page=1, page_size=10):
              FROM reviews rv, users u
              WHERE rv.user_id = u.id AND
                    rv.recipe_id = ?
-             ORDER BY rv.created DESC
+             ORDER BY rv.created DESC, rv.id DESC
              LIMIT ? OFFSET ?'''
     offset = (page - 1) * page_size
     return db.query(sql, (recipe_id, page_size, offset))
 
+def get_reviews_for_recipe_seek(recipe_id, page_size=10, after=None, before=None):
+    if before:
+        seek, order, params = '(rv.created, rv.id) > (?, ?)', 'ASC', list(before)
+    elif after:
+        seek, order, params = '(rv.created, rv.id) < (?, ?)', 'DESC', list(after)
+    else:
+        seek, order, params = '1', 'DESC', []
+    sql = f'''SELECT rv.id,
+                     rv.recipe_id,
+                     rv.user_id,
+                     rv.rating,
+                     rv.comment,
+                     rv.created,
+                     rv.modified,
+                     u.username
+              FROM reviews rv, users u
+              WHERE rv.user_id = u.id AND
+                    rv.recipe_id = ? AND
+                    {seek}
+              ORDER BY rv.created {order}, rv.id {order}
+              LIMIT ?'''
+    reviews = db.query(sql, [recipe_id] + params + [page_size])
+    return reviews[::-1] if before else reviews
+
 def get_reviews_for_recipe_count(recipe_id):
-    sql = '''SELECT COUNT(*) AS count
-             FROM reviews rv
-             WHERE rv.recipe_id = ?'''
+    sql = '''SELECT s.review_count AS count
+             FROM recipe_stats s
+             WHERE s.recipe_id = ?'''
     result = db.query(sql, (recipe_id,))
     return result[0]['count'] if result else 0
 
 def get_average_rating_for_recipe(recipe_id):
-    sql = '''SELECT AVG(rv.rating) AS average_rating,
-                    COUNT(rv.id) AS review_count
-             FROM reviews rv
-             WHERE rv.recipe_id = ?'''
+    sql = '''SELECT s.average_rating,
+                    s.review_count
+             FROM recipe_stats s
+             WHERE s.recipe_id = ?'''
     result = db.query(sql, (recipe_id,))
     if result and result[0]['review_count'] > 0:
         return {
@@ -110,3 +134,16 @@ def delete_review(review_id):
     sql = '''DELETE FROM reviews
              WHERE id = ?'''
     db.execute(sql, (review_id,))
+
+def rebuild_recipe_stats():
+    with db.transaction():
+        db.execute('DELETE FROM recipe_stats')
+        sql = '''INSERT INTO recipe_stats (recipe_id,
+                                           rating_sum,
+                                           review_count)
+                 SELECT rv.recipe_id,
+                        SUM(rv.rating),
+                        COUNT(rv.id)
+                 FROM reviews rv
+                 GROUP BY rv.recipe_id'''
+        db.execute(sql)
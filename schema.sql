@@ -1,15 +1,15 @@
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     id            INTEGER PRIMARY KEY,
     username      TEXT CHECK (username != '') NOT NULL UNIQUE,
     password_hash TEXT CHECK (password_hash != '') NOT NULL,
     created       TEXT DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE TABLE recipes (
+CREATE TABLE IF NOT EXISTS recipes (
     id            INTEGER PRIMARY KEY,
     name          TEXT NOT NULL,
     content       TEXT,
-    image         BLOB,
+    image_hash    TEXT,
     image_type    TEXT,
     user_id       INTEGER,
     created       TEXT DEFAULT CURRENT_TIMESTAMP,
@@ -17,7 +17,7 @@ CREATE TABLE recipes (
     FOREIGN KEY(user_id) REFERENCES users(id)
 );
 
-CREATE TABLE reviews (
+CREATE TABLE IF NOT EXISTS reviews (
     id            INTEGER PRIMARY KEY,
     recipe_id     INTEGER,
     user_id       INTEGER,
@@ -30,12 +30,12 @@ CREATE TABLE reviews (
     UNIQUE(recipe_id, user_id)
 );
 
-CREATE TABLE tags (
+CREATE TABLE IF NOT EXISTS tags (
     id            INTEGER PRIMARY KEY,
     name          TEXT NOT NULL UNIQUE
 );
 
-CREATE TABLE recipe_tags (
+CREATE TABLE IF NOT EXISTS recipe_tags (
     recipe_id     INTEGER,
     tag_id        INTEGER,
     FOREIGN KEY(recipe_id) REFERENCES recipes(id) ON DELETE CASCADE,
@@ -43,30 +43,331 @@ CREATE TABLE recipe_tags (
     UNIQUE(recipe_id, tag_id)
 );
 
-CREATE TRIGGER update_modified
+CREATE TABLE IF NOT EXISTS recipe_stats (
+    recipe_id      INTEGER PRIMARY KEY,
+    rating_sum     INTEGER NOT NULL DEFAULT 0,
+    review_count   INTEGER NOT NULL DEFAULT 0,
+    average_rating REAL GENERATED ALWAYS AS (CAST(rating_sum AS REAL) / review_count) VIRTUAL,
+    FOREIGN KEY(recipe_id) REFERENCES recipes(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name          TEXT PRIMARY KEY,
+    value         INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS recipe_imports (
+    key           TEXT PRIMARY KEY,
+    user_id       INTEGER,
+    lines         INTEGER NOT NULL DEFAULT 0,
+    recipes       INTEGER NOT NULL DEFAULT 0,
+    errors        INTEGER NOT NULL DEFAULT 0,
+    finished      INTEGER NOT NULL DEFAULT 0,
+    modified      TEXT DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(user_id) REFERENCES users(id)
+);
+
+CREATE TABLE IF NOT EXISTS tag_index_changes (
+    seq           INTEGER PRIMARY KEY,
+    recipe_id     INTEGER,
+    names_changed INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+    name,
+    content,
+    content='recipes',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS update_modified
 AFTER UPDATE ON recipes
 FOR EACH ROW
 BEGIN
     UPDATE recipes SET modified = CURRENT_TIMESTAMP WHERE id = OLD.id;
 END;
 
-CREATE TRIGGER update_review_modified
+CREATE TRIGGER IF NOT EXISTS update_review_modified
 AFTER UPDATE ON reviews
 FOR EACH ROW
 BEGIN
     UPDATE reviews SET modified = CURRENT_TIMESTAMP WHERE id = OLD.id;
 END;
 
-CREATE INDEX idx_recipe_name ON recipes(name);
-CREATE INDEX idx_tag_name ON tags(name);
-CREATE INDEX idx_recipe_tags_tag_id ON recipe_tags(tag_id);
-CREATE INDEX idx_recipe_tags_recipe_id ON recipe_tags(recipe_id);
-CREATE INDEX idx_reviews_recipe_id ON reviews(recipe_id);
-CREATE INDEX idx_reviews_user_id ON reviews(user_id);
-CREATE INDEX idx_recipes_user_id ON recipes(user_id);
-CREATE INDEX idx_users_username ON users(username);
-CREATE INDEX idx_recipes_created ON recipes(created);
-CREATE INDEX idx_reviews_created ON reviews(created);
-CREATE INDEX idx_tags_name ON tags(name);
-CREATE INDEX idx_recipe_tags_recipe_tag ON recipe_tags(recipe_id, tag_id);
-CREATE INDEX idx_reviews_recipe_user ON reviews(recipe_id, user_id);
\ No newline at end of file
+CREATE TRIGGER IF NOT EXISTS recipes_fts_insert
+AFTER INSERT ON recipes
+FOR EACH ROW
+BEGIN
+    INSERT INTO recipes_fts (rowid, name, content) VALUES (NEW.id, NEW.name, NEW.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipes_fts_update
+AFTER UPDATE OF name, content ON recipes
+FOR EACH ROW
+BEGIN
+    INSERT INTO recipes_fts (recipes_fts, rowid, name, content) VALUES ('delete', OLD.id, OLD.name, OLD.content);
+    INSERT INTO recipes_fts (rowid, name, content) VALUES (NEW.id, NEW.name, NEW.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipes_fts_delete
+AFTER DELETE ON recipes
+FOR EACH ROW
+BEGIN
+    INSERT INTO recipes_fts (recipes_fts, rowid, name, content) VALUES ('delete', OLD.id, OLD.name, OLD.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_recipe_insert
+AFTER INSERT ON recipes
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('recipes', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value) VALUES ('user_recipes:' || NEW.user_id, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_recipe_update
+AFTER UPDATE OF user_id ON recipes
+FOR EACH ROW
+BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'user_recipes:' || OLD.user_id;
+    INSERT INTO counters (name, value) VALUES ('user_recipes:' || NEW.user_id, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_recipe_delete
+AFTER DELETE ON recipes
+FOR EACH ROW
+BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'recipes';
+    UPDATE counters SET value = value - 1 WHERE name = 'user_recipes:' || OLD.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_recipe_tag_insert
+AFTER INSERT ON recipe_tags
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('tag_recipes:' || NEW.tag_id, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_recipe_tag_delete
+AFTER DELETE ON recipe_tags
+FOR EACH ROW
+BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'tag_recipes:' || OLD.tag_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_tag_insert
+AFTER INSERT ON tags
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('tag_generation', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_tag_update
+AFTER UPDATE OF name ON tags
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('tag_generation', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_tag_delete
+AFTER DELETE ON tags
+FOR EACH ROW
+BEGIN
+    DELETE FROM counters WHERE name = 'tag_recipes:' || OLD.id;
+    INSERT INTO counters (name, value) VALUES ('tag_generation', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_user_insert
+AFTER INSERT ON users
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('user_generation', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_user_update
+AFTER UPDATE OF username ON users
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('user_generation', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_user_delete
+AFTER DELETE ON users
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('user_generation', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_recipe_insert
+AFTER INSERT ON recipes
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('version:global', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_recipe_update
+AFTER UPDATE ON recipes
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('version:global', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value) VALUES ('version:recipe:' || NEW.id, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_recipe_delete
+AFTER DELETE ON recipes
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('version:global', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value) VALUES ('version:recipe:' || OLD.id, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_review_insert
+AFTER INSERT ON reviews
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('version:global', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value) VALUES ('version:recipe:' || NEW.recipe_id, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_review_update
+AFTER UPDATE ON reviews
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('version:global', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value) VALUES ('version:recipe:' || NEW.recipe_id, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_review_delete
+AFTER DELETE ON reviews
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('version:global', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value) VALUES ('version:recipe:' || OLD.recipe_id, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_recipe_tag_insert
+AFTER INSERT ON recipe_tags
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('version:global', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value) VALUES ('version:recipe:' || NEW.recipe_id, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_recipe_tag_delete
+AFTER DELETE ON recipe_tags
+FOR EACH ROW
+BEGIN
+    INSERT INTO counters (name, value) VALUES ('version:global', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (name, value) VALUES ('version:recipe:' || OLD.recipe_id, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_review_insert
+AFTER INSERT ON reviews
+FOR EACH ROW
+BEGIN
+    INSERT INTO recipe_stats (recipe_id, rating_sum, review_count)
+    VALUES (NEW.recipe_id, NEW.rating, 1)
+    ON CONFLICT(recipe_id) DO UPDATE SET rating_sum = rating_sum + NEW.rating,
+                                         review_count = review_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_review_update
+AFTER UPDATE OF recipe_id, rating ON reviews
+FOR EACH ROW
+BEGIN
+    UPDATE recipe_stats SET rating_sum = rating_sum - OLD.rating,
+                            review_count = review_count - 1
+    WHERE recipe_id = OLD.recipe_id;
+    INSERT INTO recipe_stats (recipe_id, rating_sum, review_count)
+    VALUES (NEW.recipe_id, NEW.rating, 1)
+    ON CONFLICT(recipe_id) DO UPDATE SET rating_sum = rating_sum + NEW.rating,
+                                         review_count = review_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_review_delete
+AFTER DELETE ON reviews
+FOR EACH ROW
+BEGIN
+    UPDATE recipe_stats SET rating_sum = rating_sum - OLD.rating,
+                            review_count = review_count - 1
+    WHERE recipe_id = OLD.recipe_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS tag_index_recipe_insert
+AFTER INSERT ON recipes
+FOR EACH ROW
+BEGIN
+    INSERT INTO tag_index_changes (recipe_id, names_changed) VALUES (NEW.id, 1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tag_index_recipe_update
+AFTER UPDATE OF name ON recipes
+FOR EACH ROW
+WHEN OLD.name IS NOT NEW.name
+BEGIN
+    INSERT INTO tag_index_changes (recipe_id, names_changed) VALUES (NEW.id, 1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tag_index_recipe_delete
+AFTER DELETE ON recipes
+FOR EACH ROW
+BEGIN
+    INSERT INTO tag_index_changes (recipe_id, names_changed) VALUES (OLD.id, 1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tag_index_recipe_tag_insert
+AFTER INSERT ON recipe_tags
+FOR EACH ROW
+BEGIN
+    INSERT INTO tag_index_changes (recipe_id) VALUES (NEW.recipe_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tag_index_recipe_tag_delete
+AFTER DELETE ON recipe_tags
+FOR EACH ROW
+BEGIN
+    INSERT INTO tag_index_changes (recipe_id) VALUES (OLD.recipe_id);
+END;
+
+-- Pruned every 1000 changes: the log is small, so ANALYZE makes the planner
+-- scan it, which is too slow to do on every insert of a bulk import.
+CREATE TRIGGER IF NOT EXISTS tag_index_changes_prune
+AFTER INSERT ON tag_index_changes
+FOR EACH ROW
+WHEN NEW.seq % 1000 = 0
+BEGIN
+    DELETE FROM tag_index_changes WHERE seq <= NEW.seq - 10000;
+END;
+
+CREATE INDEX IF NOT EXISTS idx_recipe_name ON recipes(name);
+CREATE INDEX IF NOT EXISTS idx_recipe_tags_tag_id ON recipe_tags(tag_id);
+CREATE INDEX IF NOT EXISTS idx_reviews_user_id ON reviews(user_id);
+CREATE INDEX IF NOT EXISTS idx_recipes_created ON recipes(created);
+CREATE INDEX IF NOT EXISTS idx_reviews_created ON reviews(created);
+CREATE INDEX IF NOT EXISTS idx_recipes_user_name ON recipes(user_id, name);
+CREATE INDEX IF NOT EXISTS idx_reviews_recipe_created ON reviews(recipe_id, created);
@@ -0,0 +1,106 @@
+import config
+import db
+import recipes_db
+import tag_index
+
+def tag_clause(tag_ids, match='any', exclude_ids=()):
+    if exclude_ids:
+        placeholders = ','.join('?' for _ in exclude_ids)
+        clause, params = tag_clause(tag_ids, match)
+        exclude = f'r.id NOT IN (SELECT rt.recipe_id FROM recipe_tags rt WHERE rt.tag_id IN ({placeholders}))'
+        return join_conditions(clause, exclude), params + list(exclude_ids)
+    if not tag_ids:
+        return '1', []
+    if match == 'all':
+        clause = ' AND '.join('r.id IN (SELECT rt.recipe_id FROM recipe_tags rt WHERE rt.tag_id = ?)'
+                              for _ in tag_ids)
+        return clause, list(tag_ids)
+    placeholders = ','.join('?' for _ in tag_ids)
+    return f'r.id IN (SELECT rt.recipe_id FROM recipe_tags rt WHERE rt.tag_id IN ({placeholders}))', list(tag_ids)
+
+def join_conditions(*conditions):
+    return ' AND '.join(condition for condition in conditions if condition != '1') or '1'
+
+RECIPE_COLUMNS = '''r.id,
+                          r.name,
+                          r.created,
+                          r.modified,
+                          r.user_id,
+                          u.username,
+                          (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                          IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count,
+                          (SELECT GROUP_CONCAT(t.name, ', ') FROM tags t, recipe_tags rt WHERE rt.recipe_id = r.id AND rt.tag_id = t.id) AS tags'''
+
+def build_search(query, tag_ids, match='any', order='name', exclude_ids=()):
+    tables, text_where, text_params, order_by = recipes_db.search_clauses(query, order)
+    tag_where, tag_params = tag_clause(tag_ids, match, exclude_ids)
+    where = join_conditions(text_where, tag_where)
+    page_sql = f'''SELECT {RECIPE_COLUMNS}
+                   FROM recipes r, users u{tables}
+                   WHERE r.user_id = u.id AND
+                         {where}
+                   ORDER BY {order_by}
+                   LIMIT ? OFFSET ?'''
+    count_tables, count_where, count_params, _ = recipes_db.search_clauses(query)
+    count_sql = f'''SELECT COUNT(*) AS count
+                    FROM recipes r{count_tables}
+                    WHERE {join_conditions(count_where, tag_where)}'''
+    return page_sql, text_params + tag_params, count_sql, count_params + tag_params
+
+def search_recipes(query, tag_ids, page, page_size, match='any', order='name', exclude_ids=()):
+    page_sql, params, _, _ = build_search(query, tag_ids, match, order, exclude_ids)
+    offset = (page - 1) * page_size
+    return db.query(page_sql, params + [page_size, offset])
+
+def get_search_count(query, tag_ids, match='any', exclude_ids=()):
+    _, _, count_sql, params = build_search(query, tag_ids, match, exclude_ids=exclude_ids)
+    result = db.query(count_sql, params)
+    return result[0]['count'] if result else 0
+
+def get_text_ids(query, order='name'):
+    if not query or not query.strip():
+        return None
+    tables, where, params, order_by = recipes_db.search_clauses(query, order)
+    order_clause = f' ORDER BY {order_by}' if order == 'rank' else ''
+    return [row['id'] for row in db.query(f'SELECT r.id FROM recipes r{tables} WHERE {where}{order_clause}', params)]
+
+def get_recipes_by_ids(ids):
+    if not ids:
+        return []
+    placeholders = ','.join('?' for _ in ids)
+    rows = db.query(f'''SELECT {RECIPE_COLUMNS}
+                         FROM recipes r, users u
+                         WHERE r.user_id = u.id AND
+                               r.id IN ({placeholders})''', list(ids))
+    by_id = {row['id']: row for row in rows}
+    return [by_id[recipe_id] for recipe_id in ids if recipe_id in by_id]
+
+def get_tag_counts(query):
+    # Matches per tag for a text search, counted in SQL so that the matching
+    # ids stay in SQLite.
+    tables, where, params, _ = recipes_db.search_clauses(query)
+    sql = f'''SELECT rt.tag_id,
+                     COUNT(*) AS count
+              FROM recipe_tags rt
+              WHERE rt.recipe_id IN (SELECT r.id FROM recipes r{tables} WHERE {where})
+              GROUP BY rt.tag_id'''
+    return {row['tag_id']: row['count'] for row in db.query(sql, params)}
+
+def search_page(query, tag_ids, page, page_size, match='any', order='name', exclude_ids=()):
+    # Returns (recipes, count, clamped page, matches per tag id). The tag
+    # counts are None without the tag index or past TAG_FACET_MAX_MATCHES.
+    if config.TAG_INDEX_ENABLED and (tag_ids or exclude_ids):
+        # Only a tag filter needs the text matches in Python, to intersect
+        # them with the tag bitmaps.
+        text_ids = get_text_ids(query, order)
+        ids, recipe_count, page, facets = tag_index.search(text_ids, tag_ids, page, page_size,
+                                                           match, order, exclude_ids)
+        return get_recipes_by_ids(ids), recipe_count, page, facets
+    recipe_count = get_search_count(query, tag_ids, match, exclude_ids)
+    page_count = max((recipe_count + page_size - 1) // page_size, 1)
+    page = min(max(page, 1), page_count)
+    recipes = search_recipes(query, tag_ids, page, page_size, match, order, exclude_ids)
+    facets = None
+    if config.TAG_INDEX_ENABLED and recipe_count <= config.TAG_FACET_MAX_MATCHES:
+        facets = get_tag_counts(query)
+    return recipes, recipe_count, page, facets
@@ -1,27 +1,24 @@
+import argparse
+import math
+import os
 import random
 import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import config
+import counters_db
+import db
+import migrations
+import recipes_db
+import reviews_db
 
-db = sqlite3.connect('database.db')
-db.execute('DELETE FROM users')
-db.execute('DELETE FROM recipes')
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-USER_COUNT = 5000
-RECIPE_COUNT = 10**5
-TAG_COUNT = 100
-
-for i in range(1, USER_COUNT + 1):
-    USERNAME = f'user{i}'
-    PASSWORD_HASH = f'hash{i}'
-    sql = 'INSERT INTO users (username, password_hash) VALUES (?, ?)'
-    db.execute(sql, (USERNAME, PASSWORD_HASH))
-
-for i in range(1, TAG_COUNT + 1):
-    TAG_NAME = f'Tag{i}'
-    db.execute('INSERT INTO tags (name) VALUES (?)', (TAG_NAME,))
-
-for i in range(1, RECIPE_COUNT + 1):
-    NAME = f'Recipe {i}'
-    CONTENT = f'''This is the content of recipe {i}.
+CONTENT = '''This is the content of recipe {i}.
     It has multiple lines. Enjoy cooking!
     Ingredients:
     - Ingredient 1
@@ -31,23 +28,152 @@ for i in range(1, RECIPE_COUNT + 1):
     2. Step two
     3. Step three
     '''
-    user_id = random.randint(1, USER_COUNT)
-    sql = 'INSERT INTO recipes (name, content, user_id) VALUES (?, ?, ?)'
-    db.execute(sql, (NAME, CONTENT, user_id))
-
-    # Randomly assign tags to the recipe
-    assigned_tags = random.sample(range(1, TAG_COUNT + 1), k=random.randint(0, 5))
-    for tag_id in assigned_tags:
-        db.execute('INSERT INTO recipe_tags (recipe_id, tag_id) VALUES (?, ?)', (i, tag_id))
-
-    # Randomly create reviews for the recipe
-    for j in range (1, USER_COUNT + 1):
-        if random.random() < 0.1:  # 10% chance of review
-            rating = random.randint(1, 5)
-            COMMENT = f'This is a review by user {j} for recipe {NAME}.'
-            sql = 'INSERT INTO reviews (recipe_id, user_id, rating, comment) VALUES (?, ?, ?, ?)'
-            db.execute(sql, (i, j, rating, COMMENT))
-
-db.commit()
-db.close()
-print(f'Seeded database with {USER_COUNT} users and {RECIPE_COUNT} recipes, including reviews.')
+
+PART_SCHEMA = '''CREATE TABLE recipes (id INTEGER PRIMARY KEY, name TEXT, content TEXT, user_id INTEGER);
+                 CREATE TABLE recipe_tags (recipe_id INTEGER, tag_id INTEGER);
+                 CREATE TABLE reviews (recipe_id INTEGER, user_id INTEGER, rating INTEGER, comment TEXT);'''
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Fill the database with generated test data.')
+    parser.add_argument('--database', default=config.DATABASE)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--recipes', type=int, default=10**5)
+    parser.add_argument('--tags', type=int, default=100)
+    parser.add_argument('--review-probability', type=float, default=0.1,
+                        help='chance that a given user has reviewed a given recipe')
+    parser.add_argument('--seed', type=int, default=42, help='random seed, same seed gives the same data')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='generate recipe ranges in this many processes and merge the results')
+    return parser.parse_args()
+
+def recipe_rows(start, stop, user_count, rng):
+    for i in range(start, stop):
+        yield i, f'Recipe {i}', CONTENT.format(i=i), rng.randint(1, user_count)
+
+def recipe_tag_rows(start, stop, tag_count, rng):
+    for i in range(start, stop):
+        for tag_id in rng.sample(range(1, tag_count + 1), k=rng.randint(0, min(5, tag_count))):
+            yield i, tag_id
+
+def review_pairs_numpy(start, stop, user_count, probability, seed):
+    rng = np.random.default_rng(seed)
+    chunk = max(1, 2_000_000 // user_count)
+    for first in range(start, stop, chunk):
+        last = min(first + chunk, stop)
+        recipe_index, user_index = np.nonzero(rng.random((last - first, user_count)) < probability)
+        ratings = rng.integers(1, 6, size=len(recipe_index))
+        yield from zip((recipe_index + first).tolist(), (user_index + 1).tolist(), ratings.tolist())
+
+def review_pairs_python(start, stop, user_count, probability, seed):
+    # Skip ahead by geometrically distributed gaps instead of drawing a
+    # random number for every (recipe, user) pair.
+    rng = random.Random(seed)
+    if probability <= 0:
+        return
+    log_miss = math.log(1 - probability) if probability < 1 else None
+    for recipe_id in range(start, stop):
+        user_id = 0
+        while True:
+            user_id += 1 if log_miss is None else 1 + int(math.log(1.0 - rng.random()) / log_miss)
+            if user_id > user_count:
+                break
+            yield recipe_id, user_id, rng.randint(1, 5)
+
+def review_rows(start, stop, user_count, probability, seed):
+    pairs = review_pairs_numpy if np is not None else review_pairs_python
+    for recipe_id, user_id, rating in pairs(start, stop, user_count, probability, seed):
+        yield recipe_id, user_id, rating, f'This is a review by user {user_id} for recipe Recipe {recipe_id}.'
+
+def generate(con, start, stop, args, seed):
+    rng = random.Random(seed)
+    con.executemany('INSERT INTO recipes (id, name, content, user_id) VALUES (?, ?, ?, ?)',
+                    recipe_rows(start, stop, args.users, rng))
+    con.executemany('INSERT INTO recipe_tags (recipe_id, tag_id) VALUES (?, ?)',
+                    recipe_tag_rows(start, stop, args.tags, rng))
+    con.executemany('INSERT INTO reviews (recipe_id, user_id, rating, comment) VALUES (?, ?, ?, ?)',
+                    review_rows(start, stop, args.users, args.review_probability, seed))
+    con.commit()
+
+def generate_part(start, stop, args, seed):
+    fd, path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(args.database)))
+    os.close(fd)
+    con = sqlite3.connect(path)
+    con.execute('PRAGMA journal_mode = OFF')
+    con.execute('PRAGMA synchronous = OFF')
+    con.executescript(PART_SCHEMA)
+    generate(con, start, stop, args, seed)
+    con.close()
+    return path
+
+def merge_part(con, path):
+    con.execute('ATTACH DATABASE ? AS part', (path,))
+    con.execute('INSERT INTO recipes (id, name, content, user_id) SELECT id, name, content, user_id FROM part.recipes')
+    con.execute('INSERT INTO recipe_tags (recipe_id, tag_id) SELECT recipe_id, tag_id FROM part.recipe_tags')
+    con.execute('INSERT INTO reviews (recipe_id, user_id, rating, comment) '
+                'SELECT recipe_id, user_id, rating, comment FROM part.reviews')
+    con.commit()
+    con.execute('DETACH DATABASE part')
+    os.remove(path)
+
+def prepare(con):
+    # Triggers and secondary indexes are dropped for the load; schema.sql
+    # recreates them afterwards and the derived tables are rebuilt in bulk.
+    for kind in ('trigger', 'index'):
+        names = [row[0] for row in con.execute('SELECT name FROM sqlite_master WHERE type = ? AND sql IS NOT NULL',
+                                               (kind,))]
+        for name in names:
+            con.execute(f'DROP {kind.upper()} {name}')
+    for table in ('reviews', 'recipe_tags', 'recipes', 'tags', 'users', 'recipe_stats'):
+        con.execute(f'DELETE FROM {table}')
+    con.execute("DELETE FROM counters WHERE name NOT LIKE 'version:%' AND name NOT IN ('tag_generation', 'user_generation')")
+    con.commit()
+
+def main():
+    args = parse_args()
+    config.DATABASE = args.database
+    config.DB_WRITE_QUEUE = False  # no writer thread holding the file open during the load
+    started = time.perf_counter()
+    migrations.migrate(progress=lambda message: None)
+    db.close_thread_connection()
+
+    con = sqlite3.connect(args.database)
+    con.execute('PRAGMA journal_mode = OFF')
+    con.execute('PRAGMA synchronous = OFF')
+    con.execute('PRAGMA cache_size = -200000')
+    prepare(con)
+    con.executemany('INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+                    ((i, f'user{i}', f'hash{i}') for i in range(1, args.users + 1)))
+    con.executemany('INSERT INTO tags (id, name) VALUES (?, ?)',
+                    ((i, f'Tag{i}') for i in range(1, args.tags + 1)))
+    con.commit()
+
+    bounds = [1 + args.recipes * part // args.workers for part in range(args.workers + 1)]
+    if args.workers == 1:
+        generate(con, 1, args.recipes + 1, args, args.seed)
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(generate_part, bounds[part], bounds[part + 1], args, args.seed + part)
+                       for part in range(args.workers)]
+            for future in futures:
+                merge_part(con, future.result())
+    con.close()
+    print(f'Inserted rows in {time.perf_counter() - started:.1f}s')
+
+    db.apply_schema()
+    reviews_db.rebuild_recipe_stats()
+    counters_db.check_counters(repair=True)
+    recipes_db.build_search_index()
+    db.execute_many('''INSERT INTO counters (name, value) VALUES (?, 1)
+                       ON CONFLICT(name) DO UPDATE SET value = value + 1''',
+                    [('tag_generation',), ('user_generation',), ('version:global',)])
+    db.execute("UPDATE counters SET value = value + 1 WHERE name LIKE 'version:recipe:%'")
+    db.execute('INSERT INTO tag_index_changes (recipe_id) VALUES (NULL)')  # reload tag indexes
+    db.execute('ANALYZE')
+    db.close_thread_connection()
+
+    review_count = sqlite3.connect(args.database).execute('SELECT COUNT(*) FROM reviews').fetchone()[0]
+    print(f'Seeded database with {args.users} users, {args.recipes} recipes and {review_count} reviews '
+          f'in {time.perf_counter() - started:.1f}s.')
+
+if __name__ == '__main__':
+    main()
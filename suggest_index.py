@@ -0,0 +1,171 @@
+import array
+import bisect
+import sys
+import threading
+import config
+import counters_db
+import db
+import tag_index
+
+# Per-process prefix index for the typeahead. Each kind of name is a sorted
+# list of lowercased keys with a parallel array of row ids, so a prefix is
+# one bisect followed by a walk over the matching keys. The names shown are
+# read by id afterwards, which keeps only the short keys in memory.
+#
+# Recipe changes come from the tag_index_changes log (names_changed rows),
+# tags and users are reloaded when their generation counter changes.
+
+SOURCES = {
+    'tags': 'SELECT id, name FROM tags',
+    'users': 'SELECT id, username AS name FROM users',
+}
+# recipe changes after which the whole list is reloaded instead
+MAX_RECIPE_UPDATES = 1000
+
+_lock = threading.Lock()
+_index = {'database': None}
+
+def make_key(name):
+    return name.casefold()[:config.SUGGEST_KEY_LENGTH]
+
+def entry_size(key_length):
+    # list slot, array item and the str object
+    return 8 + 8 + sys.getsizeof('') + key_length
+
+class Entries:
+    def __init__(self, rows=()):
+        pairs = sorted((make_key(name), row_id) for row_id, name in rows)
+        self.keys = [key for key, _ in pairs]
+        self.ids = array.array('q', (row_id for _, row_id in pairs))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def memory(self):
+        return sum(entry_size(len(key)) for key in self.keys)
+
+    def find(self, prefix, limit):
+        key = make_key(prefix)
+        position = bisect.bisect_left(self.keys, key)
+        found = []
+        while position < len(self.keys) and len(found) < limit and self.keys[position].startswith(key):
+            found.append(self.ids[position])
+            position += 1
+        return found
+
+    def add(self, row_id, name):
+        key = make_key(name)
+        position = bisect.bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.ids.insert(position, row_id)
+
+    def remove(self, row_id):
+        # The old name is not known, so look the id up in the raw array;
+        # bytes.find is much faster than array.index for a single id.
+        data = self.ids.tobytes()
+        needle = array.array('q', [row_id]).tobytes()
+        offset = data.find(needle)
+        while offset != -1 and offset % self.ids.itemsize:
+            offset = data.find(needle, offset + 1)
+        if offset == -1:
+            return
+        position = offset // self.ids.itemsize
+        del self.keys[position]
+        del self.ids[position]
+
+def load_rows(sql):
+    return [(row['id'], row['name']) for row in db.query(sql)]
+
+def load_recipes(budget):
+    result = db.query(f'SELECT COUNT(*) AS count, AVG(MIN(LENGTH(name), {int(config.SUGGEST_KEY_LENGTH)})) AS length FROM recipes')
+    count, length = result[0]['count'], result[0]['length'] or 0
+    fits = max(int(budget // entry_size(length)), 0)
+    if count <= fits:
+        return Entries(load_rows('SELECT id, name FROM recipes')), False
+    rows = db.query('''SELECT r.id,
+                              r.name
+                       FROM recipes r LEFT JOIN recipe_stats s ON s.recipe_id = r.id
+                       ORDER BY IFNULL(s.review_count, 0) DESC, r.id
+                       LIMIT ?''', (fits,))
+    return Entries((row['id'], row['name']) for row in rows), True
+
+def load(seq, generations):
+    entries = {kind: Entries(load_rows(sql)) for kind, sql in SOURCES.items()}
+    budget = config.SUGGEST_MAX_MEMORY - sum(kind.memory() for kind in entries.values())
+    entries['recipes'], partial = load_recipes(budget)
+    return {
+        'database': config.DATABASE,
+        'seq': seq,
+        'generations': generations,
+        'entries': entries,
+        'partial': partial,
+    }
+
+def apply_recipe_changes(index, seq):
+    changes = db.query('''SELECT DISTINCT recipe_id
+                          FROM tag_index_changes
+                          WHERE seq > ? AND
+                                names_changed = 1''', (index['seq'],))
+    recipe_ids = [change['recipe_id'] for change in changes]
+    if None in recipe_ids or len(recipe_ids) > MAX_RECIPE_UPDATES:
+        return False
+    entries = index['entries']['recipes']
+    for recipe_id in recipe_ids:
+        entries.remove(recipe_id)
+    if recipe_ids:
+        placeholders = ','.join('?' for _ in recipe_ids)
+        for row in db.query(f'SELECT id, name FROM recipes WHERE id IN ({placeholders})', recipe_ids):
+            entries.add(row['id'], row['name'])
+    index['seq'] = seq
+    return True
+
+def get_index():
+    global _index
+    with _lock:
+        seq, first = tag_index.get_latest_change()
+        generations = dict(zip(SOURCES, counters_db.get_counters(['tag_generation', 'user_generation'])))
+        index = _index
+        if index['database'] != config.DATABASE or index['seq'] < first - 1:
+            index = load(seq, generations)
+        else:
+            for kind, sql in SOURCES.items():
+                if index['generations'][kind] != generations[kind]:
+                    index['entries'][kind] = Entries(load_rows(sql))
+            index['generations'] = generations
+            if index['seq'] != seq and not apply_recipe_changes(index, seq):
+                index = load(seq, generations)
+        _index = index
+        return index
+
+def get_names(table, column, ids):
+    if not ids:
+        return []
+    placeholders = ','.join('?' for _ in ids)
+    names = {row['id']: row['name'] for row in
+             db.query(f'SELECT id, {column} AS name FROM {table} WHERE id IN ({placeholders})', ids)}
+    return [(row_id, names[row_id]) for row_id in ids if row_id in names]
+
+def suggest(prefix, limit):
+    index = get_index()
+    # Keys are cut short, so longer prefixes are checked against the names.
+    long_prefix = len(prefix.casefold()) > config.SUGGEST_KEY_LENGTH
+    with _lock:
+        found = {kind: entries.find(prefix, limit * 10 if long_prefix else limit)
+                 for kind, entries in index['entries'].items()}
+    result = {}
+    for kind, table, column in (('recipes', 'recipes', 'name'), ('tags', 'tags', 'name'),
+                                ('users', 'users', 'username')):
+        names = get_names(table, column, found[kind])
+        names = [(row_id, name) for row_id, name in names if name.casefold().startswith(prefix.casefold())]
+        result[kind] = names[:limit]
+    return result
+
+def stats():
+    index = get_index()
+    with _lock:
+        return {
+            'entries': {kind: len(entries) for kind, entries in index['entries'].items()},
+            'memory': sum(entries.memory() for entries in index['entries'].values()),
+            'max_memory': config.SUGGEST_MAX_MEMORY,
+            'partial': index['partial'],
+        }
@@ -0,0 +1,148 @@
+import threading
+import config
+import db
+
+# Per-process index of which recipes carry which tag. Every set is a Python
+# int used as a bitmap: bit n is set when recipe n is in the set, so AND,
+# OR and NOT over 100k recipes are single big-integer operations. The
+# index follows the tag_index_changes log that the triggers in schema.sql
+# write, re-reading only the recipes that changed since the last search.
+
+BYTE_BITS = [[bit for bit in range(8) if byte >> bit & 1] for byte in range(256)]
+
+_lock = threading.Lock()
+_index = {'database': None}
+
+def bits_from_ids(ids):
+    ids = list(ids)
+    if not ids:
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for recipe_id in ids:
+        data[recipe_id >> 3] |= 1 << (recipe_id & 7)
+    return int.from_bytes(data, 'little')
+
+def ids_from_bits(bits):
+    ids = []
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for position, byte in enumerate(data):
+        if byte:
+            ids.extend(position * 8 + bit for bit in BYTE_BITS[byte])
+    return ids
+
+def count(bits):
+    return bin(bits).count('1')
+
+def get_latest_change():
+    result = db.query('SELECT MAX(seq) AS seq, MIN(seq) AS first FROM tag_index_changes')
+    return result[0]['seq'] or 0, result[0]['first'] or 0
+
+def load():
+    seq, _ = get_latest_change()
+    members = {}
+    for row in db.query('SELECT tag_id, recipe_id FROM recipe_tags'):
+        members.setdefault(row['tag_id'], []).append(row['recipe_id'])
+    return {
+        'database': config.DATABASE,
+        'seq': seq,
+        'tags': {tag_id: bits_from_ids(ids) for tag_id, ids in members.items()},
+        'recipes': bits_from_ids(row['id'] for row in db.query('SELECT id FROM recipes')),
+        'rank': None,
+    }
+
+def apply_changes(index, seq):
+    changes = db.query('''SELECT recipe_id,
+                                 MAX(names_changed) AS names_changed
+                          FROM tag_index_changes
+                          WHERE seq > ?
+                          GROUP BY recipe_id''', (index['seq'],))
+    if any(change['recipe_id'] is None for change in changes):
+        return load()  # the whole table was rewritten, e.g. by seed.py
+    recipe_ids = [change['recipe_id'] for change in changes]
+    placeholders = ','.join('?' for _ in recipe_ids)
+    mask = bits_from_ids(recipe_ids)
+    tags = {tag_id: bits & ~mask for tag_id, bits in index['tags'].items()}
+    added = {}
+    for row in db.query(f'SELECT tag_id, recipe_id FROM recipe_tags WHERE recipe_id IN ({placeholders})',
+                        recipe_ids):
+        added.setdefault(row['tag_id'], []).append(row['recipe_id'])
+    for tag_id, ids in added.items():
+        tags[tag_id] = tags.get(tag_id, 0) | bits_from_ids(ids)
+    existing = bits_from_ids(row['id'] for row in
+                             db.query(f'SELECT id FROM recipes WHERE id IN ({placeholders})', recipe_ids))
+    return {
+        'database': index['database'],
+        'seq': seq,
+        'tags': {tag_id: bits for tag_id, bits in tags.items() if bits},
+        'recipes': index['recipes'] & ~mask | existing,
+        'rank': None if any(change['names_changed'] for change in changes) else index['rank'],
+    }
+
+def get_index():
+    # The queries run without the lock; it is only held to swap in the
+    # result, keeping whichever of two concurrent refreshes is newer.
+    global _index
+    seq, first = get_latest_change()
+    index = _index
+    if index['database'] != config.DATABASE or index['seq'] < first - 1:
+        index = load()  # new database, or fell behind the pruned log
+    elif index['seq'] != seq:
+        index = apply_changes(index, seq)
+    with _lock:
+        if _index['database'] == index['database'] and _index['seq'] > index['seq']:
+            return _index
+        _index = index
+    return index
+
+def get_rank(index):
+    # recipe id -> position in name order, loaded when first needed after a
+    # recipe was added, renamed or removed. The query sees a later state than
+    # the index, so the list covers every id in the index bitmap and recipes
+    # deleted in between sort last.
+    if index['rank'] is None:
+        ids = [row['id'] for row in db.query('SELECT id FROM recipes ORDER BY name ASC, id ASC')]
+        rank = [len(ids)] * max(index['recipes'].bit_length(), max(ids, default=0) + 1)
+        for position, recipe_id in enumerate(ids):
+            rank[recipe_id] = position
+        index['rank'] = rank
+    return index['rank']
+
+def select(index, tag_ids, match='any', exclude_ids=()):
+    tags = index['tags']
+    if not tag_ids:
+        bits = index['recipes']
+    elif match == 'all':
+        bits = index['recipes']
+        for tag_id in tag_ids:
+            bits &= tags.get(tag_id, 0)
+    else:
+        bits = 0
+        for tag_id in tag_ids:
+            bits |= tags.get(tag_id, 0)
+        bits &= index['recipes']  # stay within the ids get_rank() covers
+    for tag_id in exclude_ids:
+        bits &= ~tags.get(tag_id, 0)
+    return bits
+
+def facets(index, bits):
+    return {tag_id: count(bits & tag_bits) for tag_id, tag_bits in index['tags'].items()}
+
+def search(text_ids, tag_ids, page, page_size, match='any', order='name', exclude_ids=()):
+    # text_ids are the full-text matches, in rank order for order='rank', or
+    # None without a text query.
+    index = get_index()
+    bits = select(index, tag_ids, match, exclude_ids)
+    if text_ids is not None:
+        bits &= bits_from_ids(text_ids)
+    total = count(bits)
+    page_count = max((total + page_size - 1) // page_size, 1)
+    page = min(max(page, 1), page_count)
+    start = (page - 1) * page_size
+    if text_ids is not None and order == 'rank':
+        data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+        ids = [i for i in text_ids if i >> 3 < len(data) and data[i >> 3] >> (i & 7) & 1]
+    else:
+        rank = get_rank(index)
+        ids = ids_from_bits(bits)
+        ids.sort(key=rank.__getitem__)
+    return ids[start:start + page_size], total, page, facets(index, bits)
@@ -1,10 +1,14 @@
+import config
+import counters_db
 import db
+import recipes_db
+
+_tag_cache = {'generation': None}
 
 def add_tag(name):
     sql = '''INSERT INTO tags (name)
              VALUES (?)'''
-    db.execute(sql, (name,))
-    return db.last_insert_id()
+    return db.execute(sql, (name,))
 
 def delete_tag(tag_id):
     sql = '''DELETE FROM tags
@@ -18,6 +22,22 @@ def get_all_tags():
              ORDER BY t.name ASC'''
     return db.query(sql)
 
+def get_tag_generation():
+    return counters_db.get_counter('tag_generation')
+
+def get_tag_cache():
+    global _tag_cache
+    generation = (config.DATABASE, get_tag_generation())
+    if _tag_cache['generation'] != generation:
+        tags = get_all_tags()
+        _tag_cache = {
+            'generation': generation,
+            'tags': tags,
+            'name_to_id': {tag['name']: tag['id'] for tag in tags},
+            'id_to_name': {tag['id']: tag['name'] for tag in tags},
+        }
+    return _tag_cache
+
 def add_tag_to_recipe(recipe_id, tag_id):
     sql = '''INSERT INTO recipe_tags (recipe_id, tag_id)
              VALUES (?, ?)'''
@@ -29,6 +49,31 @@ def remove_tag_from_recipe(recipe_id, tag_id):
                    tag_id = ?'''
     db.execute(sql, (recipe_id, tag_id))
 
+def set_recipe_tags(recipe_id, names):
+    names = list(dict.fromkeys(names))
+    placeholders = ','.join('?' for _ in names)
+    with db.transaction():
+        old_tag_ids = [row['tag_id'] for row in db.query('SELECT tag_id FROM recipe_tags WHERE recipe_id = ?',
+                                                         (recipe_id,))]
+        db.execute_many('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(name,) for name in names])
+        db.execute(f'''DELETE FROM recipe_tags
+                       WHERE recipe_id = ? AND
+                             tag_id NOT IN (SELECT t.id FROM tags t WHERE t.name IN ({placeholders}))''',
+                   [recipe_id] + names)
+        db.execute(f'''INSERT OR IGNORE INTO recipe_tags (recipe_id, tag_id)
+                       SELECT ?, t.id
+                       FROM tags t
+                       WHERE t.name IN ({placeholders})''',
+                   [recipe_id] + names)
+        delete_unused_tags(old_tag_ids)
+
+def delete_unused_tags(tag_ids):
+    placeholders = ','.join('?' for _ in tag_ids)
+    sql = f'''DELETE FROM tags
+              WHERE id IN ({placeholders}) AND
+                    NOT EXISTS (SELECT 1 FROM recipe_tags rt WHERE rt.tag_id = tags.id)'''
+    db.execute(sql, list(tag_ids))
+
 def get_tags_for_recipe(recipe_id):
     sql = '''SELECT t.id,
                     t.name
@@ -38,6 +83,17 @@ def get_tags_for_recipe(recipe_id):
              ORDER BY t.name ASC'''
     return db.query(sql, (recipe_id,))
 
+def get_tag_names_for_recipes(recipe_ids):
+    id_to_name = get_tag_cache()['id_to_name']
+    sql = '''SELECT rt.recipe_id,
+                    rt.tag_id
+             FROM recipe_tags rt
+             WHERE rt.recipe_id IN ({placeholders})'''
+    names = {recipe_id: [] for recipe_id in recipe_ids}
+    for row in db.query_in(sql, recipe_ids):
+        names[row['recipe_id']].append(id_to_name.get(row['tag_id']))
+    return {recipe_id: sorted(filter(None, tag_names)) for recipe_id, tag_names in names.items()}
+
 def get_recipes_for_tag(tag_id):
     sql = '''SELECT r.id,
                     r.name,
@@ -45,8 +101,8 @@ def get_recipes_for_tag(tag_id):
                     r.modified,
                     r.user_id,
                     u.username,
-                    (SELECT AVG(rv.rating) FROM reviews rv WHERE rv.recipe_id = r.id) AS average_rating,
-                    (SELECT COUNT(rv.id) FROM reviews rv WHERE rv.recipe_id = r.id) AS review_count
+                    (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                    IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count
              FROM recipes r, users u, recipe_tags rt
              WHERE rt.tag_id = ? AND
                    rt.recipe_id = r.id AND
@@ -62,8 +118,8 @@ def get_recipes_for_tags(tag_ids):
                              r.modified,
                              r.user_id,
                              u.username,
-                             (SELECT AVG(rv.rating) FROM reviews rv WHERE rv.recipe_id = r.id) AS average_rating,
-                             (SELECT COUNT(rv.id) FROM reviews rv WHERE rv.recipe_id = r.id) AS review_count
+                             (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                             IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count
               FROM recipes r, users u, recipe_tags rt
               WHERE rt.tag_id IN ({placeholders}) AND
                     rt.recipe_id = r.id AND
@@ -79,8 +135,8 @@ def get_recipes_for_tag_paginated(tag_id, page, page_size):
                     r.modified,
                     r.user_id,
                     u.username,
-                    (SELECT AVG(rv.rating) FROM reviews rv WHERE rv.recipe_id = r.id) AS average_rating,
-                    (SELECT COUNT(rv.id) FROM reviews rv WHERE rv.recipe_id = r.id) AS review_count
+                    (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                    IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count
              FROM recipes r, users u, recipe_tags rt
              WHERE rt.tag_id = ? AND
                    rt.recipe_id = r.id AND
@@ -90,62 +146,59 @@ def get_recipes_for_tag_paginated(tag_id, page, page_size):
     return db.query(sql, (tag_id, page_size, offset))
 
 def get_recipe_count_for_tag(tag_id):
-    sql = '''SELECT COUNT(*) AS count
-             FROM recipe_tags rt
-             WHERE rt.tag_id = ?'''
-    result = db.query(sql, (tag_id,))
-    return result[0]['count'] if result else 0
+    return counters_db.get_counter(f'tag_recipes:{tag_id}')
 
-def search_recipes_filtered_by_tags(query, tag_ids):
+def search_recipes_filtered_by_tags(query, tag_ids, order='name'):
     placeholders = ','.join('?' for _ in tag_ids)
+    tables, where, params, order_by = recipes_db.search_clauses(query, order)
     sql = f'''SELECT DISTINCT r.id,
                              r.name,
                              r.created,
                              r.modified,
                              r.user_id,
                              u.username,
-                             (SELECT AVG(rv.rating) FROM reviews rv WHERE rv.recipe_id = r.id) AS average_rating,
-                             (SELECT COUNT(rv.id) FROM reviews rv WHERE rv.recipe_id = r.id) AS review_count
-              FROM recipes r, users u, recipe_tags rt
+                             (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                             IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count
+              FROM recipes r, users u, recipe_tags rt{tables}
               WHERE r.user_id = u.id AND
-                    (r.name LIKE ? OR r.content LIKE ?) AND
+                    {where} AND
                     rt.recipe_id = r.id AND
                     rt.tag_id IN ({placeholders})
-              ORDER BY r.name ASC'''
-    params = ['%' + query + '%', '%' + query + '%'] + tag_ids
-    results = db.query(sql, params)
+              ORDER BY {order_by}'''
+    results = db.query(sql, params + tag_ids)
     return results if results else None
 
-def search_recipes_filtered_by_tags_paginated(query, tag_ids, page, page_size):
+def search_recipes_filtered_by_tags_paginated(query, tag_ids, page, page_size, order='name'):
     offset = (page - 1) * page_size
     placeholders = ','.join('?' for _ in tag_ids)
+    tables, where, params, order_by = recipes_db.search_clauses(query, order)
     sql = f'''SELECT DISTINCT r.id,
                              r.name,
                              r.created,
                              r.modified,
                              r.user_id,
                              u.username,
-                             (SELECT AVG(rv.rating) FROM reviews rv WHERE rv.recipe_id = r.id) AS average_rating,
-                             (SELECT COUNT(rv.id) FROM reviews rv WHERE rv.recipe_id = r.id) AS review_count
-              FROM recipes r, users u, recipe_tags rt
+                             (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                             IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count
+              FROM recipes r, users u, recipe_tags rt{tables}
               WHERE r.user_id = u.id AND
-                    (r.name LIKE ? OR r.content LIKE ?) AND
+                    {where} AND
                     rt.recipe_id = r.id AND
                     rt.tag_id IN ({placeholders})
-              ORDER BY r.name ASC
+              ORDER BY {order_by}
               LIMIT ? OFFSET ?'''
-    params = ['%' + query + '%', '%' + query + '%'] + tag_ids + [page_size, offset]
+    params = params + tag_ids + [page_size, offset]
     return db.query(sql, params)
 
 def get_recipe_count_filtered_by_tags(query, tag_ids):
     placeholders = ','.join('?' for _ in tag_ids)
+    tables, where, params, _ = recipes_db.search_clauses(query)
     sql = f'''SELECT COUNT(DISTINCT r.id) AS count
-             FROM recipes r, recipe_tags rt
-             WHERE (r.name LIKE ? OR r.content LIKE ?) AND
+             FROM recipes r, recipe_tags rt{tables}
+             WHERE {where} AND
                    rt.recipe_id = r.id AND
                    rt.tag_id IN ({placeholders})'''
-    params = ['%' + query + '%', '%' + query + '%'] + tag_ids
-    result = db.query(sql, params)
+    result = db.query(sql, params + tag_ids)
     return result[0]['count'] if result else 0
 
 def is_tag_used(tag_id):
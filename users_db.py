@@ -1,3 +1,4 @@
+import counters_db
 import db
 
 def create_user(username, password_hash):
@@ -15,6 +16,13 @@ def get_user(username):
     result = db.query(sql, (username,))
     return result[0] if result else None
 
+def get_usernames(user_ids):
+    sql = '''SELECT id,
+                    username
+             FROM users
+             WHERE id IN ({placeholders})'''
+    return {row['id']: row['username'] for row in db.query_in(sql, user_ids)}
+
 def get_user_recipes(user_id):
     sql = '''SELECT r.id,
                     r.name,
@@ -27,11 +35,7 @@ def get_user_recipes(user_id):
     return db.query(sql, (user_id,))
 
 def get_user_recipe_count(user_id):
-    sql = '''SELECT COUNT(*) AS count
-             FROM recipes r
-             WHERE r.user_id = ?'''
-    result = db.query(sql, (user_id,))
-    return result[0]['count'] if result else 0
+    return counters_db.get_counter(f'user_recipes:{user_id}')
 
 def get_user_recipes_paginated(user_id, page, page_size):
     offset = (page - 1) * page_size
@@ -40,10 +44,32 @@ def get_user_recipes_paginated(user_id, page, page_size):
                     r.created,
                     r.modified,
                     r.user_id,
-                    (SELECT AVG(rv.rating) FROM reviews rv WHERE rv.recipe_id = r.id) AS average_rating,
-                    (SELECT COUNT(rv.id) FROM reviews rv WHERE rv.recipe_id = r.id) AS review_count
+                    (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                    IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count
              FROM recipes r
              WHERE r.user_id = ?
-             ORDER BY r.name ASC
+             ORDER BY r.name ASC, r.id ASC
              LIMIT ? OFFSET ?'''
     return db.query(sql, (user_id, page_size, offset))
+
+def get_user_recipes_seek(user_id, page_size, after=None, before=None):
+    if before:
+        seek, order, params = '(r.name, r.id) < (?, ?)', 'DESC', list(before)
+    elif after:
+        seek, order, params = '(r.name, r.id) > (?, ?)', 'ASC', list(after)
+    else:
+        seek, order, params = '1', 'ASC', []
+    sql = f'''SELECT r.id,
+                     r.name,
+                     r.created,
+                     r.modified,
+                     r.user_id,
+                     (SELECT s.average_rating FROM recipe_stats s WHERE s.recipe_id = r.id) AS average_rating,
+                     IFNULL((SELECT s.review_count FROM recipe_stats s WHERE s.recipe_id = r.id), 0) AS review_count
+              FROM recipes r
+              WHERE r.user_id = ? AND
+                    {seek}
+              ORDER BY r.name {order}, r.id {order}
+              LIMIT ?'''
+    recipes = db.query(sql, [user_id] + params + [page_size])
+    return recipes[::-1] if before else recipes
@@ -0,0 +1,41 @@
+import config
+
+# Rules for recipe input, shared by the add and edit forms and the bulk
+# import. Messages are shown to the user as they are.
+
+MAX_NAME_LENGTH = 100
+MAX_CONTENT_LENGTH = 5000
+
+def allowed_image(filename):
+    return ('.' in filename and
+            filename.rsplit('.', 1)[1].lower() in config.ALLOWED_IMAGE_EXTENSIONS)
+
+def image_type(filename):
+    return filename.rsplit('.', 1)[1].lower()
+
+def image_type_errors(filename):
+    if not allowed_image(filename):
+        return ['Invalid image file type.']
+    return []
+
+def image_size_errors(data):
+    if len(data) > config.MAX_IMAGE_SIZE:
+        max_size = config.MAX_IMAGE_SIZE / (1024 * 1024)
+        return [f'Image file size exceeds the maximum limit of {max_size:.2f} MB.']
+    return []
+
+def image_errors(filename, data):
+    return image_type_errors(filename) or image_size_errors(data)
+
+def recipe_errors(name, content):
+    errors = []
+    if not name:
+        errors.append('Recipe name is required.')
+    if len(name) > MAX_NAME_LENGTH:
+        errors.append(f'Recipe name is too long (maximum {MAX_NAME_LENGTH} characters).')
+    if len(content) > MAX_CONTENT_LENGTH:
+        errors.append(f'Recipe content is too long (maximum {MAX_CONTENT_LENGTH} characters).')
+    return errors
+
+def parse_tags(text):
+    return text.casefold().replace(',', ' ').split()